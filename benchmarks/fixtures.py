@@ -0,0 +1,173 @@
+"""
+Generate synthetic input files for the benchmarks.
+
+The CLM fixtures have the variables, dimensions and file names read by the
+clm_data scripts: a surface data file on a regular grid of the benchmarked
+resolution (stored under the 0.125x0.125 file name, so that the scripts run
+with -d), the 0.9x1.25 surface data file with the canopy heights, and the
+clm5_params and pft-physiology files. The FLUXNET fixture is a BIF CSV with the
+SITE_ID, GROUP_ID, VARIABLE_GROUP, VARIABLE, DATAVALUE columns of the
+FLX_AA-Flx_BIF files.
+
+Every fixture is a function of its size and a seed only, so benchmarks run on
+different trees read the same inputs.
+"""
+
+import csv
+import os
+import sys
+
+import netCDF4 as nc
+import numpy as np
+
+CLM_PARAMS_FILE = 'clm5_params.c171117.nc'
+PFT_PHYSIOLOGY_FILE = 'pft-physiology.c110225.nc'
+LOWRES_SURFACE_FILE = 'surfdata_0.9x1.25_16pfts__CMIP6_simyr2000_c170616.nc'
+HIGHRES_SURFACE_FILE = 'surfdata_0.125x0.125_16pfts_simyr2000_c151014.nc'
+CLM_FILES = [CLM_PARAMS_FILE, PFT_PHYSIOLOGY_FILE, LOWRES_SURFACE_FILE, HIGHRES_SURFACE_FILE]
+
+# Grid of the real 0.9x1.25 surface data
+LOWRES_SHAPE = (192, 288)
+LOWRES_NATPFT = 15
+HIGHRES_NATPFT = 17
+LSMPFT = 17
+N_PFT_PARAMS = 79
+N_PFT_PHYSIOLOGY = 21
+# Number of natural PFTs present in a land cell, at most
+PFTS_PER_CELL = 4
+LAND_FRACTION = 0.3
+# Latitude rows generated at once
+GENERATE_ROWS = 64
+
+def clm_grid(resolution):
+    """Cell centers of the global regular grid with a spacing of resolution degrees."""
+    n_lat = int(round(180 / resolution))
+    n_lon = int(round(360 / resolution))
+    lat = -90 + resolution * (np.arange(n_lat) + 0.5)
+    lon = resolution * (np.arange(n_lon) + 0.5)
+    return lat, lon
+
+def _pct_nat_pft_rows(rng, natpft, n_rows, n_lon):
+    """PCT_NAT_PFT of n_rows latitude rows: a few PFTs per cell, summing to 100."""
+    pct = np.zeros((natpft, n_rows, n_lon))
+    shares = rng.dirichlet(np.ones(PFTS_PER_CELL), size=(n_rows, n_lon))
+    pfts = rng.integers(0, natpft, size=(n_rows, n_lon, PFTS_PER_CELL))
+    rows, columns = np.indices((n_rows, n_lon))
+    for k in range(PFTS_PER_CELL):
+        np.add.at(pct, (pfts[..., k], rows, columns), np.round(shares[..., k] * 100, 2))
+    # ocean cells are bare ground
+    ocean = rng.random((n_rows, n_lon)) > LAND_FRACTION
+    pct[:, ocean] = 0
+    pct[0, ocean] = 100
+    return pct, ocean
+
+def write_surface_data(path, lat, lon, natpft, heights=True, seed=0):
+    """Write a surface data file on the grid lat x lon, one band of rows at a time."""
+    rng = np.random.default_rng(seed)
+    n_lat, n_lon = len(lat), len(lon)
+    with nc.Dataset(path, 'w', format='NETCDF4_CLASSIC') as dataset:
+        dataset.createDimension('lsmlat', n_lat)
+        dataset.createDimension('lsmlon', n_lon)
+        dataset.createDimension('natpft', natpft)
+        latixy = dataset.createVariable('LATIXY', 'f8', ('lsmlat', 'lsmlon'))
+        longxy = dataset.createVariable('LONGXY', 'f8', ('lsmlat', 'lsmlon'))
+        pct_nat_pft = dataset.createVariable('PCT_NAT_PFT', 'f8', ('natpft', 'lsmlat', 'lsmlon'))
+        soil_color = dataset.createVariable('SOIL_COLOR', 'i4', ('lsmlat', 'lsmlon'))
+        if heights:
+            dataset.createDimension('time', 12)
+            dataset.createDimension('lsmpft', LSMPFT)
+            height_top = dataset.createVariable('MONTHLY_HEIGHT_TOP', 'f8', ('time', 'lsmpft', 'lsmlat', 'lsmlon'))
+        for start in range(0, n_lat, GENERATE_ROWS):
+            band = slice(start, min(start + GENERATE_ROWS, n_lat))
+            n_rows = band.stop - band.start
+            latixy[band, :] = np.repeat(lat[band, None], n_lon, axis=1)
+            longxy[band, :] = np.repeat(lon[None, :], n_rows, axis=0)
+            pct, ocean = _pct_nat_pft_rows(rng, natpft, n_rows, n_lon)
+            pct_nat_pft[:, band, :] = pct
+            colors = rng.integers(1, 21, size=(n_rows, n_lon))
+            colors[ocean] = 0
+            soil_color[band, :] = colors
+            if heights:
+                seasonal = 1 + 0.2 * np.sin(np.arange(12) * np.pi / 6)
+                top = rng.uniform(0, 30, size=(1, LSMPFT, n_rows, n_lon))
+                height_top[:, :, band, :] = seasonal[:, None, None, None] * top
+
+def write_clm_params(path, seed=0):
+    rng = np.random.default_rng(seed)
+    with nc.Dataset(path, 'w', format='NETCDF4_CLASSIC') as dataset:
+        dataset.createDimension('pft', N_PFT_PARAMS)
+        dataset.createDimension('allpfts', 1)
+        dataset.createVariable('rootprof_beta', 'f8', ('allpfts', 'pft'))[:] = rng.uniform(0.9, 0.99, (1, N_PFT_PARAMS))
+        dataset.createVariable('medlynslope', 'f8', ('pft',))[:] = rng.uniform(1, 10, N_PFT_PARAMS)
+        dataset.createVariable('medlynintercept', 'f8', ('pft',))[:] = rng.uniform(0, 1e4, N_PFT_PARAMS)
+
+def write_pft_physiology(path, seed=0):
+    rng = np.random.default_rng(seed)
+    with nc.Dataset(path, 'w', format='NETCDF4_CLASSIC') as dataset:
+        dataset.createDimension('pft', N_PFT_PHYSIOLOGY)
+        for name in ['rholnir', 'rholvis', 'taulnir', 'taulvis', 'tausnir', 'tausvis', 'xl']:
+            dataset.createVariable(name, 'f8', ('pft',))[:] = rng.uniform(0, 0.6, N_PFT_PHYSIOLOGY)
+        dataset.createVariable('vcmx25', 'f8', ('pft',))[:] = rng.uniform(20, 100, N_PFT_PHYSIOLOGY)
+
+def clm_fixture(directory, resolution, seed=0):
+    """Write the CLM input files for resolution into directory, unless they exist.
+
+    Returns the shape of the benchmarked grid.
+    """
+    lat, lon = clm_grid(resolution)
+    if all(os.path.isfile(os.path.join(directory, name)) for name in CLM_FILES):
+        return len(lat), len(lon)
+    os.makedirs(directory, exist_ok=True)
+    write_clm_params(os.path.join(directory, CLM_PARAMS_FILE), seed)
+    write_pft_physiology(os.path.join(directory, PFT_PHYSIOLOGY_FILE), seed)
+    write_surface_data(os.path.join(directory, LOWRES_SURFACE_FILE),
+                       np.linspace(-90, 90, LOWRES_SHAPE[0]), 1.25 * np.arange(LOWRES_SHAPE[1]),
+                       LOWRES_NATPFT, seed=seed)
+    # The heights of this file are taken from the 0.9x1.25 file, as for the real data
+    write_surface_data(os.path.join(directory, HIGHRES_SURFACE_FILE), lat, lon,
+                       HIGHRES_NATPFT, heights=False, seed=seed + 1)
+    return len(lat), len(lon)
+
+def write_fluxnet_bif(path, n_sites, seed=0):
+    """Write a BIF CSV for n_sites sites; returns its number of data rows."""
+    rng = np.random.default_rng(seed)
+    n_rows = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['SITE_ID', 'GROUP_ID', 'VARIABLE_GROUP', 'VARIABLE', 'DATAVALUE'])
+        group_id = 0
+        for site in range(n_sites):
+            site_id = f"X{site // 1000:d}-{site % 1000:03d}"
+            def group(variable_group, values):
+                nonlocal group_id, n_rows
+                group_id += 1
+                for variable, value in values:
+                    writer.writerow([site_id, group_id, variable_group, variable, value])
+                    n_rows += 1
+            group('GRP_LOCATION', [('LOCATION_LAT', f"{rng.uniform(-60, 80):.4f}"),
+                                   ('LOCATION_LONG', f"{rng.uniform(-180, 180):.4f}"),
+                                   ('LOCATION_ELEV', f"{rng.uniform(0, 3000):.0f}")])
+            group('GRP_UTC_OFFSET', [('UTC_OFFSET', str(rng.integers(-10, 12)))])
+            group('GRP_CLIM_AVG', [('MAT', f"{rng.uniform(-10, 28):.1f}"),
+                                   ('MAP', f"{rng.uniform(100, 3000):.0f}")])
+            for _ in range(rng.integers(0, 4)):
+                group('GRP_HEIGHTC', [('HEIGHTC', f"{rng.uniform(0.1, 40):.1f}"),
+                                      ('HEIGHTC_DATE', '20050701')])
+            variables = ['CO2_F_MDS', 'TA_F_MDS', 'SW_IN_F_MDS']
+            variables += [f"SWC_F_MDS_{i}" for i in range(1, rng.integers(1, 4))]
+            variables += [f"TS_F_MDS_{i}" for i in range(1, rng.integers(1, 4))]
+            for variable in variables:
+                height = rng.uniform(-1, 0) if variable.startswith(('SWC', 'TS')) else rng.uniform(2, 60)
+                group('GRP_VAR_INFO', [('VAR_INFO_VARNAME', variable),
+                                       ('VAR_INFO_HEIGHT', f"{height:.2f}"),
+                                       ('VAR_INFO_DATE', '20000101')])
+    return n_rows
+
+if __name__ == "__main__":
+    # Run by run_benchmarks.py in a child process, so that the memory used to
+    # generate the fixtures does not count in the peak RSS of the benchmarks
+    kind, path, size, seed = sys.argv[1:]
+    if kind == 'clm':
+        print(*clm_fixture(path, float(size), int(seed)))
+    else:
+        print(write_fluxnet_bif(path, int(size), int(seed)))
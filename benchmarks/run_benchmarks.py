@@ -0,0 +1,282 @@
+"""
+Benchmark the Python processing scripts of the artifacts on synthetic inputs.
+
+Every script runs in a child process in a fresh temporary directory holding the
+fixtures, with the same command line as in its create_artifact.jl. The wall
+time, the peak resident memory of the child process and the throughput are
+appended, with the commit of the benchmarked tree, to a JSON history:
+
+    python benchmarks/run_benchmarks.py --label before
+    git checkout my-branch
+    python benchmarks/run_benchmarks.py --label after --compare before
+
+--repo benchmarks another checkout of the repository with the same fixtures.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from importlib import metadata
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_REPO = os.path.dirname(BENCHMARK_DIR)
+DEFAULT_FIXTURES_DIR = os.path.join(BENCHMARK_DIR, 'fixtures')
+DEFAULT_HISTORY = os.path.join(BENCHMARK_DIR, 'history.json')
+FIXTURES_SCRIPT = os.path.join(BENCHMARK_DIR, 'fixtures.py')
+
+CLM_FILES = ['clm5_params.c171117.nc', 'pft-physiology.c110225.nc',
+             'surfdata_0.9x1.25_16pfts__CMIP6_simyr2000_c170616.nc',
+             'surfdata_0.125x0.125_16pfts_simyr2000_c151014.nc']
+
+CLM_RESOLUTIONS = [1.0, 0.25, 0.125]
+FLUXNET_SITES = [200, 2000]
+SUITES = ['clm', 'fluxnet', 'twostream']
+
+# clm_data scripts run in one directory, in this order, since each stage reads
+# the outputs of the previous ones
+CLM_STAGES = [
+    ('dominant_pft', ['dominant_pft.py', '-d']),
+    ('vegetation', ['pft_variables.py', '-d']),
+    ('soil', ['soil_variables.py', '-d']),
+]
+CLM_PIPELINE = ('pipeline', ['clm_pipeline.py', '--output-dir-highres', '.'])
+
+def run_command(command, cwd, timeout=None):
+    """Run command in cwd; returns (return code, wall time in s, peak RSS in MiB)."""
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=stderr)
+        deadline = None if timeout is None else start + timeout
+        while True:
+            # wait4 gives the resource usage of this child only
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            if deadline is not None and time.perf_counter() > deadline:
+                process.kill()
+                pid, status, usage = os.wait4(process.pid, 0)
+                break
+            time.sleep(0.01)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            stderr.seek(0)
+            print(stderr.read().decode(errors='replace'), file=sys.stderr)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss = usage.ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+    return process.returncode, wall, rss
+
+def measure(command, cwd, repeat, timeout, prepare=None):
+    """Best wall time of repeat runs, with the peak RSS of that run."""
+    best = None
+    for _ in range(repeat):
+        if prepare is not None:
+            prepare()
+        result = run_command(command, cwd, timeout)
+        if result[0] != 0:
+            return result
+        if best is None or result[1] < best[1]:
+            best = result
+    return best
+
+def record(suite, script, case, result, amount, unit):
+    returncode, wall, rss = result
+    entry = {
+        'suite': suite, 'script': script, 'case': case,
+        'status': 'ok' if returncode == 0 else f"failed ({returncode})",
+        'wall_s': round(wall, 4), 'peak_rss_mib': round(rss, 1),
+        'throughput': round(amount / wall, 1) if returncode == 0 and wall > 0 else None,
+        'throughput_unit': unit,
+    }
+    print(f"{suite:10s} {script:16s} {case:14s} {entry['status']:12s} {wall:9.2f} s "
+          f"{rss:9.1f} MiB  {entry['throughput'] or '-'} {unit}")
+    return entry
+
+def skipped(suite, script, case, reason):
+    print(f"{suite:10s} {script:16s} {case:14s} skipped: {reason}")
+    return {'suite': suite, 'script': script, 'case': case, 'status': f"skipped: {reason}"}
+
+def make_fixture(kind, path, size, seed):
+    """Generate a fixture with fixtures.py in a child process; returns the numbers it prints.
+
+    The children inherit the peak RSS of this process, which is kept small by
+    not generating the fixtures here.
+    """
+    output = subprocess.run([sys.executable, FIXTURES_SCRIPT, kind, path, str(size), str(seed)],
+                            capture_output=True, text=True, check=True).stdout
+    return [int(value) for value in output.split()]
+
+def link_inputs(source_dir, names, work_dir):
+    for name in names:
+        os.symlink(os.path.join(source_dir, name), os.path.join(work_dir, name))
+
+def bench_clm(args):
+    clm_dir = os.path.join(args.repo, 'clm_data')
+    extra = shlex.split(args.clm_args)
+    results = []
+    for resolution in args.resolutions:
+        case = f"{resolution:g}deg"
+        fixture_dir = os.path.join(args.fixtures_dir, f"clm_{case}_seed{args.seed}")
+        n_lat, n_lon = make_fixture('clm', fixture_dir, resolution, args.seed)
+        cells = n_lat * n_lon
+        with tempfile.TemporaryDirectory() as work_dir:
+            link_inputs(fixture_dir, CLM_FILES, work_dir)
+            failed = False
+            for stage, (script, *options) in CLM_STAGES:
+                if failed:
+                    results.append(skipped('clm', stage, case, 'an earlier stage failed'))
+                    continue
+                command = [sys.executable, os.path.join(clm_dir, script)] + options + extra
+                result = measure(command, work_dir, args.repeat, args.timeout)
+                failed = result[0] != 0
+                results.append(record('clm', stage, case, result, cells, 'cells/s'))
+        stage, (script, *options) = CLM_PIPELINE
+        if not os.path.isfile(os.path.join(clm_dir, script)):
+            results.append(skipped('clm', stage, case, f"no {script} in this tree"))
+            continue
+        with tempfile.TemporaryDirectory() as work_dir:
+            link_inputs(fixture_dir, CLM_FILES, work_dir)
+            command = [sys.executable, os.path.join(clm_dir, script)] + options + extra
+            # remove the remap cache of the previous repeat
+            prepare = lambda: shutil.rmtree(os.path.join(work_dir, 'remap_cache'), ignore_errors=True)
+            result = measure(command, work_dir, args.repeat, args.timeout, prepare)
+            results.append(record('clm', stage, case, result, cells, 'cells/s'))
+    return results
+
+def bench_fluxnet(args):
+    script = os.path.join(args.repo, 'fluxnet2015', 'process_metadata.py')
+    results = []
+    for n_sites in args.fluxnet_sites:
+        case = f"{n_sites}sites"
+        with tempfile.TemporaryDirectory() as work_dir:
+            bif = os.path.join(work_dir, 'bif.csv')
+            n_rows, = make_fixture('fluxnet', bif, n_sites, args.seed)
+            command = [sys.executable, script, bif, os.path.join(work_dir, 'out', 'metadata_clean.csv')]
+            result = measure(command, work_dir, args.repeat, args.timeout)
+            results.append(record('fluxnet', 'process_metadata', case, result, n_rows, 'rows/s'))
+    return results
+
+def bench_twostream(args):
+    twostr_dir = os.path.join(args.repo, 'twostr_test')
+    # gen_2str_data.py imports the PySellersTwoStream clone of create_artifacts.jl
+    if not os.path.isdir(os.path.join(twostr_dir, 'py3SellersTwoStream')):
+        return [skipped('twostream', 'gen_2str_data', 'default', 'py3SellersTwoStream is not cloned')]
+    cases = [('default', [])]
+    if os.path.isfile(os.path.join(twostr_dir, 'two_stream_batch.py')):
+        cases.append(('batch', ['--batch']))
+    results = []
+    for case, options in cases:
+        with tempfile.TemporaryDirectory() as work_dir:
+            output = os.path.join(work_dir, 'twostr_test.csv')
+            command = [sys.executable, 'gen_2str_data.py', output] + options
+            result = measure(command, twostr_dir, args.repeat, args.timeout)
+            n_cases = 0
+            if result[0] == 0:
+                with open(output) as f:
+                    n_cases = sum(1 for _ in f) - 1
+            results.append(record('twostream', 'gen_2str_data', case, result, n_cases, 'cases/s'))
+    return results
+
+BENCHMARKS = {'clm': bench_clm, 'fluxnet': bench_fluxnet, 'twostream': bench_twostream}
+
+def git_commit(repo):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+def load_history(path):
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+def save_history(path, history):
+    # write to a temporary name first so that an interrupted run keeps the old history
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w') as f:
+        json.dump(history, f, indent=1)
+    os.replace(temporary_path, path)
+
+def compare(run, reference):
+    """Print the ratio of the wall times and peak RSS of run to those of reference."""
+    previous = {(r['suite'], r['script'], r['case']): r for r in reference['results'] if r['status'] == 'ok'}
+    print(f"\nCompared to '{reference['label']}' ({reference['commit']}, {reference['timestamp']}):")
+    for result in run['results']:
+        key = (result['suite'], result['script'], result['case'])
+        if result['status'] != 'ok' or key not in previous:
+            continue
+        old = previous[key]
+        print(f"{key[0]:10s} {key[1]:16s} {key[2]:14s} time x{result['wall_s'] / old['wall_s']:.3f} "
+              f"({old['wall_s']:.2f} -> {result['wall_s']:.2f} s), "
+              f"RSS x{result['peak_rss_mib'] / old['peak_rss_mib']:.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the artifact processing scripts on synthetic inputs')
+    parser.add_argument('suites', nargs='*', metavar='SUITE',
+                        help=f"benchmarks to run, among {', '.join(SUITES)} (default all)")
+    parser.add_argument('--repo', default=DEFAULT_REPO, help="checkout of the repository to benchmark")
+    parser.add_argument('--resolutions', type=float, nargs='+', default=CLM_RESOLUTIONS,
+                        help="grid spacings in degrees of the clm_data benchmarks")
+    parser.add_argument('--fluxnet-sites', type=int, nargs='+', default=FLUXNET_SITES,
+                        help="numbers of sites of the FLUXNET metadata benchmarks")
+    parser.add_argument('--clm-args', default='',
+                        help="extra options for every clm_data script, e.g. '--workers 4'")
+    parser.add_argument('--repeat', type=int, default=1, help="keep the fastest of this many runs")
+    parser.add_argument('--timeout', type=float, default=None, help="kill a script after this many seconds")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic inputs")
+    parser.add_argument('--fixtures-dir', default=DEFAULT_FIXTURES_DIR,
+                        help="directory where the generated inputs are kept between runs")
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help="JSON file the results are appended to")
+    parser.add_argument('--label', default=None, help="name of this run in the history")
+    parser.add_argument('--compare', nargs='?', const='', default=None, metavar='LABEL',
+                        help="compare with the last run of this label, or the previous run if no label is given")
+    args = parser.parse_args()
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown benchmarks {', '.join(sorted(unknown))}; choose from {', '.join(SUITES)}")
+    args.repo = os.path.abspath(args.repo)
+
+    commit = git_commit(args.repo)
+    run = {
+        'label': args.label or commit or 'unlabeled',
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'repo': args.repo,
+        'host': platform.node(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': metadata.version('numpy'),
+        'options': {'clm_args': args.clm_args, 'repeat': args.repeat, 'seed': args.seed},
+        'results': [],
+    }
+    for suite in dict.fromkeys(args.suites or SUITES):
+        run['results'] += BENCHMARKS[suite](args)
+
+    history = load_history(args.history)
+    if args.compare is not None:
+        candidates = [r for r in history if not args.compare or r['label'] == args.compare]
+        if candidates:
+            compare(run, candidates[-1])
+        else:
+            print(f"\nNo run to compare with in {args.history}")
+    history.append(run)
+    save_history(args.history, history)
+    print(f"\nResults appended to {args.history}")
+    if any(result['status'].startswith('failed') for result in run['results']):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,37 @@
+import argparse
 import zipfile
 import os
 import sys
 from pathlib import Path
 
-from urllib.request import urlopen
-from shutil import copyfileobj
+# The HTTP downloader shared by the download scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "download_tools"))
+from http_download import ZENODO_API, download_all, zenodo_files
 
+RECORD_ID = "12768877"
+ZIP_NAMES = [
+    "radarlidar_seasonal_10x10.zip",
+    "radarlidar_seasonal_2.5x2.5.zip",
+    "radarlidar_monthly_10x10.zip",
+    "radarlidar_monthly_2.5x2.5.zip",
+]
 
-def download_and_unzip_cloudsat():
-    """Download the cloudsat data and save them to where this file is located"""
+
+def download_and_unzip_cloudsat(zenodo_api=ZENODO_API):
+    """Download the cloudsat data and save them to where this file is located
+
+    The zip files are downloaded in parallel, resuming partial downloads, and
+    checked against the size and MD5 checksum of the Zenodo record. Zip files
+    that are already downloaded are not downloaded again.
+    """
     dir_path = Path(os.path.dirname(os.path.realpath(__file__)))
     # Download data
-    seasonal_10_zip = dir_path.joinpath("radarlidar_seasonal_10x10.zip")
-    seasonal_2_5_zip = dir_path.joinpath("radarlidar_seasonal_2.5x2.5.zip")
-    monthly_10_zip = dir_path.joinpath("radarlidar_monthly_10x10.zip")
-    monthly_2_5_zip = dir_path.joinpath("radarlidar_monthly_2.5x2.5.zip")
-    zip_files = [seasonal_10_zip, seasonal_2_5_zip, monthly_10_zip, monthly_2_5_zip]
-    download_links = [
-        "https://zenodo.org/records/12768877/files/radarlidar_seasonal_10x10.zip?download=1",
-        "https://zenodo.org/records/12768877/files/radarlidar_seasonal_2.5x2.5.zip?download=1",
-        "https://zenodo.org/records/12768877/files/radarlidar_monthly_10x10.zip?download=1",
-        "https://zenodo.org/records/12768877/files/radarlidar_monthly_2.5x2.5.zip?download=1",
-    ]
-    for download_link, zip_file in zip(download_links, zip_files):
-        with urlopen(download_link) as in_stream, open(zip_file, "wb") as out_file:
-            copyfileobj(in_stream, out_file)
+    failed = download_all(zenodo_files(RECORD_ID, ZIP_NAMES, zenodo_api), dir_path)
+    if failed:
+        raise RuntimeError(
+            f"Failed to download {', '.join(download.target for download, _ in failed)}; rerun to resume"
+        )
+    zip_files = [dir_path.joinpath(name) for name in ZIP_NAMES]
 
     # Find files and unzip them
     unzip_directory = dir_path.joinpath("radarlidar_data")
@@ -37,7 +44,11 @@ def download_and_unzip_cloudsat():
 
 
 if __name__ == "__main__":
-    download_and_unzip_cloudsat()
+    parser = argparse.ArgumentParser(description="Download and unzip the 3S-GEOPROF-COMB dataset")
+    parser.add_argument("--zenodo-api", default=ZENODO_API,
+                        help="URL of the Zenodo API, e.g. of a local server (see download_tools/file_server.py)")
+    args = parser.parse_args()
+    download_and_unzip_cloudsat(args.zenodo_api)
     print(
         "The data should be downloaded and stored in radarlidar_data. You can now delete the zip files"
     )
@@ -0,0 +1,577 @@
+"""
+Compute the dominant PFT, vegetation property and soil albedo maps of the
+clm_data artifacts in a single process.
+
+Every input file is opened once. The surface data is read one latitude band at
+a time, and each band is shared by the three stages, which write their
+outputs into pre-created NetCDF variables. Both resolutions can be processed in
+one invocation:
+
+    python clm_pipeline.py --output-dir lowres_dir --output-dir-highres highres_dir
+
+`dominant_pft.py`, `pft_variables.py` and `soil_variables.py` run a single stage
+of this pipeline.
+"""
+
+import argparse
+import os
+from collections import namedtuple
+
+import netCDF4 as nc
+import numpy as np
+
+from grid_remap import (DEFAULT_CACHE_DIR, conservative_matrices, conservative_remap, nearest_indices,
+                        nearest_remap)
+from latitude_bands import add_band_arguments, latitude_bands, rows_per_band
+from parallel_bands import map_bands
+from pft_parameters import PARAMETER_NAMES, build_parameter_table, gather_parameter_maps, weighted_parameter_maps
+
+# Paths to input files
+CLM_PARAMS_FILE = 'clm5_params.c171117.nc'
+PFT_PHYSIOLOGY_FILE = 'pft-physiology.c110225.nc'
+LOWRES = '0.9x1.25'
+HIGHRES = '0.125x0.125'
+SURFACE_FILES = {
+    LOWRES: 'surfdata_0.9x1.25_16pfts__CMIP6_simyr2000_c170616.nc',
+    HIGHRES: 'surfdata_0.125x0.125_16pfts_simyr2000_c151014.nc',
+}
+
+DOMINANT_PFT = 'dominant_pft'
+VEGETATION = 'vegetation'
+SOIL = 'soil'
+OUTPUT_FILES = {
+    DOMINANT_PFT: 'dominant_PFT_map.nc',
+    VEGETATION: 'vegetation_properties_map.nc',
+    SOIL: 'soil_properties_map.nc',
+}
+STAGES = tuple(OUTPUT_FILES)
+
+# pft index 14 is the only C4 pft
+C4_PFT = 14
+
+# Table taken from CLM5.0 Tech Note Table 3.3 Dry and saturated soil albedos
+# COLUMNS: Dry vis, Dry nir, Saturated vis, Saturated nir
+SOIL_ALBEDOS = np.array([[0.36, 0.61, 0.25, 0.50],    # color = 1
+                      [0.34, 0.57, 0.23,0.46],    # color = 2
+                      [0.32, 0.53, 0.21, 0.42],    # color = 3
+                      [0.31, 0.51, 0.20, 0.40],    # color = 4
+                      [0.30, 0.49, 0.19, 0.38],    # color = 5
+                      [0.29, 0.48, 0.18, 0.36],    # color = 6
+                      [0.28, 0.45, 0.17, 0.34],    # color = 7
+                      [0.27, 0.43, 0.16, 0.32],    # color = 8
+                      [0.26, 0.41, 0.15, 0.30],    # color = 9
+                      [0.25, 0.39, 0.14, 0.28],    # color = 10
+                      [0.24, 0.37, 0.13, 0.26],    # color = 11
+                      [0.23, 0.35, 0.12, 0.24],    # color = 12
+                      [0.22, 0.33, 0.11, 0.22],    # color = 13
+                      [0.20, 0.31, 0.10, 0.20],    # color = 14
+                      [0.18, 0.29, 0.09, 0.18],    # color = 15
+                      [0.16, 0.27, 0.08, 0.16],    # color = 16
+                      [0.14, 0.25, 0.07, 0.14],    # color = 17
+                      [0.12, 0.23, 0.06, 0.12],    # color = 18
+                      [0.10, 0.21, 0.05, 0.10],    # color = 19
+                      [0.08, 0.16, 0.04, 0.08]])   # color = 20
+
+# Variables of the vegetation output, in the order they are created and written
+VEGETATION_VARIABLES = ['z_top', 'c3_dominant', 'medlynslope', 'medlynintercept', 'c3_proportion',
+                        'rholnir', 'rholvis', 'rooting_depth', 'taulnir', 'taulvis', 'tausnir',
+                        'tausvis', 'vcmx25', 'xl']
+VEGETATION_ATTRIBUTES = [
+    ('lat', 'units', 'degrees_north'),
+    ('lon', 'units', 'degrees_east'),
+    ('z_top', 'units', 'm'),
+    ('z_top', 'long_name', 'Canopy top height'),
+    ('z_top', 'short_name', 'z_top'),
+    ('c3_dominant', 'units', '0. = c4, 1. = c3'),
+    ('c3_dominant', 'long_name', 'c3 dominant'),
+    ('medlynslope', 'units', 'kPa^0.5'),
+    ('medlynslope', 'long_name', 'Medlyn slope of conductance-photosynthesis relationship'),
+    ('medlynintercept', 'units', 'umol m^-2 s^-1'),
+    ('medlynintercept', 'long_name', 'Medlyn intercept of conductance-photosynthesis relationship'),
+    ('c3_proportion', 'long_name', 'Proportion of plants that are c3'),
+    ('c3_proportion', 'units', 'proportion c3'),
+    ('rholnir', 'units', 'fraction'),
+    ('rholvis', 'long_name', "Leaf reflectance: near-IR"),
+    ('rholvis', 'units', 'fraction'),
+    ('rholnir', 'long_name', "Leaf reflectance: visible"),
+    ('rooting_depth', 'long_name', 'Rooting Depth Parameter'),
+    ('rooting_depth', 'units', 'm'),
+    ('taulnir', 'units', 'fraction'),
+    ('taulnir', 'long_name', 'Leaf transmittance: near-IR'),
+    ('taulvis', 'units', 'fraction'),
+    ('taulvis', 'long_name', 'Leaf transmittance: visible'),
+    ('tausnir', 'units', 'fraction'),
+    ('tausnir', 'long_name', 'Stem transmittance: near-IR'),
+    ('tausvis', 'units', 'fraction'),
+    ('tausvis', 'long_name', 'Stem transmittance: visible'),
+    ('vcmx25', 'units', 'umol CO2/m**2/s'),
+    ('vcmx25', 'long_name', 'Maximum rate of carboxylation at 25 degrees Celsius'),
+    ('xl', 'units', '[-1 to 1]'),
+    ('xl', 'long_name', 'Leaf/stem orientation index'),
+]
+
+# Variables of the soil output, with the column of the albedo buffer they come from
+SOIL_VARIABLES = [('PAR_albedo_dry', 0), ('NIR_albedo_dry', 1), ('PAR_albedo_wet', 2), ('NIR_albedo_wet', 3)]
+SOIL_ATTRIBUTES = [
+    ('lat', 'units', 'degrees_north'),
+    ('lon', 'units', 'degrees_east'),
+    ('PAR_albedo_dry', 'units', "[0 to 1]"),
+    ('PAR_albedo_dry', 'long_name', "PAR albedo dry"),
+    ('NIR_albedo_dry', 'units', "[0 to 1]"),
+    ('NIR_albedo_dry', 'long_name', "NIR albedo dry"),
+    ('PAR_albedo_wet', 'units', "[0 to 1]"),
+    ('PAR_albedo_wet', 'long_name', "PAR albedo saturated"),
+    ('NIR_albedo_wet', 'units', "[0 to 1]"),
+    ('NIR_albedo_wet', 'long_name', "NIR albedo saturated"),
+]
+
+# MONTHLY_HEIGHT_TOP of another surface data file, read whole, with its 1D coordinates
+CoarseHeights = namedtuple('CoarseHeights', ['values', 'lat', 'lon'])
+
+def read_coarse_heights(dataset):
+    """Read the canopy heights of dataset to map them onto another grid."""
+    return CoarseHeights(
+        values=dataset.variables['MONTHLY_HEIGHT_TOP'][:, :, :, :],
+        lat=np.mean(dataset.variables['LATIXY'][:, :], axis=1),
+        lon=np.mean(dataset.variables['LONGXY'][:, :], axis=0),
+    )
+
+def dominant_pft_band(pct_nat_pft, top_k=1):
+    """Find the top_k PFTs of every gridcell in a (natpft, nlat, nlon) band.
+
+    Returns a list of (index, fraction) pairs, most common PFT first. Ties go to
+    the lowest PFT index, as with np.argmax. Masked percentages never win; a
+    cell where every PFT is masked gets index 0 and a masked fraction.
+    """
+    pct_nat_pft = np.ma.asarray(pct_nat_pft)
+    # Same ordering as np.ma.argmax: masked entries are replaced by -inf
+    remaining = pct_nat_pft.filled(-np.inf).astype(np.float64)
+    rows, cols = np.indices(remaining.shape[1:])
+    ranked = []
+    for _ in range(top_k):
+        index = np.argmax(remaining, axis=0).astype(np.int32)
+        percentage = remaining[index, rows, cols]
+        fraction = np.ma.masked_invalid(np.where(np.isneginf(percentage), np.nan, percentage / 100))
+        ranked.append((index, fraction))
+        remaining[index, rows, cols] = -np.inf
+    return ranked
+
+def canopy_height_band(dominant_pft, band, height_var=None, coarse_heights=None,
+                       nearest_index=None, conservative=None):
+    """Monthly mean canopy height of the dominant PFT for the rows in band.
+
+    The heights are read from height_var, on the same grid as dominant_pft, or
+    mapped from coarse_heights. nearest_index is then the (lat_index,
+    lon_index) of the nearest coarse cell, broadcasting to the band, and
+    conservative, if given instead, is (lat_matrix, lon_matrix, mean_heights,
+    valid_heights) with the matrices of grid_remap.conservative_matrices, the
+    monthly mean coarse heights of every PFT, 0 where masked, and 1 where they
+    are valid, 0 elsewhere. The remapped heights are normalized by the
+    remapped validity, so masked coarse cells are left out of the average.
+    """
+    pft_index = np.ma.filled(dominant_pft, -1)
+    source = coarse_heights.values if coarse_heights is not None else height_var
+    valid_pft = (pft_index >= 0) & (pft_index < source.shape[1])
+    pft_index = np.where(valid_pft, pft_index, 0)
+    row_index, col_index = np.indices(pft_index.shape)
+    if conservative is not None:
+        lat_matrix, lon_matrix, mean_heights, valid_heights = conservative
+        # (n_pft, rows, nlon): the mean heights of every PFT, remapped to the band
+        heights = lat_matrix[band] @ mean_heights @ lon_matrix.T
+        coverage = lat_matrix[band] @ valid_heights @ lon_matrix.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            heights = np.where(coverage > 0, heights / coverage, np.nan)
+        canopy_height = heights[pft_index, row_index, col_index]
+        return np.where(valid_pft, canopy_height, np.nan).astype(np.float32)
+    if coarse_heights is not None:
+        # here we use the lower resolution height data to map the canopy height
+        lat_index, lon_index = nearest_index
+        dominant_height = coarse_heights.values[:, pft_index, lat_index, lon_index]
+    else:
+        dominant_height = height_var[:, :, band, :][:, pft_index, row_index, col_index]
+    # average with the months as the contiguous last axis, as the per-cell mean did
+    canopy_height = np.ma.asarray(dominant_height).transpose(1, 2, 0).copy().mean(axis=-1)
+    return np.where(valid_pft, np.ma.filled(canopy_height, np.nan), np.nan).astype(np.float32)
+
+def vegetation_band(dominant_pft, pct_nat_pft, parameter_table, canopy_height, weighted=False):
+    """Compute every variable of the vegetation output for one band.
+
+    If weighted, the parameters are averaged over all the PFTs of each cell
+    instead of taken from the dominant PFT.
+    """
+    if weighted:
+        parameter_maps = weighted_parameter_maps(parameter_table, pct_nat_pft).astype(np.float32)
+    else:
+        # Map the parameter values to the grid points based on the dominant PFT
+        parameter_maps = np.moveaxis(gather_parameter_maps(parameter_table, dominant_pft).astype(np.float32), -1, 0)
+    maps = dict(zip(PARAMETER_NAMES, parameter_maps))
+    c3_dominant_map = (dominant_pft != C4_PFT).astype(float)
+    maps['z_top'] = canopy_height
+    maps['c3_dominant'] = c3_dominant_map
+    maps['c3_proportion'] = np.ones_like(c3_dominant_map) - (pct_nat_pft[C4_PFT]/100)
+    return maps
+
+def soil_albedo_kernel(soil_colors, out=None):
+    """Map soil color to all four albedos with one gather into a (ny, nx, 4) buffer.
+
+    The last axis follows the columns of SOIL_ALBEDOS. Colors outside 1-20,
+    and masked colors, are mapped to NaN.
+    """
+    soil_colors = np.ma.asarray(soil_colors)
+    colors = soil_colors.filled(0).astype(np.intp)
+    if out is None:
+        out = np.empty(colors.shape + (SOIL_ALBEDOS.shape[1],), dtype=np.float32)
+    # Row 0 of the padded table is NaN and absorbs the invalid colors, so
+    # that soil color c maps to row c
+    padded = np.vstack([np.full((1, SOIL_ALBEDOS.shape[1]), np.nan), SOIL_ALBEDOS])
+    valid = (colors >= 1) & (colors <= SOIL_ALBEDOS.shape[0])
+    out[...] = padded[np.where(valid, colors, 0)]
+    return out
+
+def blend_soil_moisture(albedos, soil_moisture):
+    """Overwrite the saturated albedos in albedos with the albedos at soil_moisture.
+
+    As in the CLM5.0 Tech Note, the albedo increases from the saturated
+    value by max(0.11 - 0.40 * soil_moisture, 0), but stays below the dry value.
+    Returns the PAR and NIR albedos as a view of albedos[..., 2:].
+    """
+    increase = np.float32(max(0.11 - 0.40 * soil_moisture, 0))
+    blended = albedos[..., 2:]
+    blended += increase
+    np.minimum(blended, albedos[..., :2], out=blended)
+    return blended
+
+def bytes_per_row(n_lon, natpft, n_height_values, stages, top_k=1, weighted=False):
+    """Approximate memory used per latitude row while processing a band."""
+    # coordinates as read and the 1D averages
+    size = 4 * 8 * n_lon
+    if DOMINANT_PFT in stages or VEGETATION in stages:
+        # PCT_NAT_PFT as read (values and mask), its filled float64 copy, and the ranked PFTs
+        size += natpft * n_lon * (8 + 1 + 8) + top_k * 24 * n_lon
+    if VEGETATION in stages:
+        # MONTHLY_HEIGHT_TOP as read, the gathered heights, and the mapped fields
+        size += n_lon * (9 * n_height_values + 12 * len(PARAMETER_NAMES) + 9 * 24 + 64)
+        if weighted:
+            # the filled weights and the two contractions
+            size += n_lon * 8 * (natpft + 3 * len(PARAMETER_NAMES))
+    if SOIL in stages:
+        size += n_lon * (8 + 4 * 4 + 16)
+    return size
+
+# Everything compute_band needs besides the surface data. nearest is the
+# (lat_index, lon_index) of grid_remap.nearest_remap, and conservative the
+# argument of canopy_height_band, if coarse_heights are remapped that way.
+BandInputs = namedtuple('BandInputs', ['stages', 'top_k', 'weighted', 'soil_moisture', 'parameter_table',
+                                       'coarse_heights', 'nearest', 'conservative'])
+
+def compute_band(surface_dataset, inputs, band):
+    """Compute every output variable of inputs.stages for the rows in band.
+
+    Returns a dict from variable name to its (rows, nlon) array.
+    """
+    results = {}
+    stages = inputs.stages
+    if DOMINANT_PFT in stages or VEGETATION in stages:
+        pct_nat_pft = surface_dataset.variables['PCT_NAT_PFT'][:, band, :]
+        ranked = dominant_pft_band(pct_nat_pft, inputs.top_k)
+    if DOMINANT_PFT in stages:
+        results["dominant_PFT"] = ranked[0][0]
+        if inputs.top_k > 1:
+            results["dominant_PFT_fraction"] = ranked[0][1]
+            results["second_PFT"], results["second_PFT_fraction"] = ranked[1]
+    if VEGETATION in stages:
+        dominant_pft = ranked[0][0]
+        coarse_heights = inputs.coarse_heights
+        if inputs.conservative is not None:
+            canopy_height = canopy_height_band(dominant_pft, band, coarse_heights=coarse_heights,
+                                               conservative=inputs.conservative)
+        elif coarse_heights is not None:
+            if inputs.nearest is not None:
+                lat_index, lon_index = inputs.nearest
+                nearest_index = (lat_index[band, None], lon_index[None, :])
+            else:
+                # search the nearest coarse cell of every cell of the band
+                shape = dominant_pft.shape
+                nearest_index = (
+                    nearest_indices(coarse_heights.lat, surface_dataset.variables['LATIXY'][band, :].ravel()).reshape(shape),
+                    nearest_indices(coarse_heights.lon, surface_dataset.variables['LONGXY'][band, :].ravel()).reshape(shape),
+                )
+            canopy_height = canopy_height_band(dominant_pft, band, coarse_heights=coarse_heights,
+                                               nearest_index=nearest_index)
+        else:
+            canopy_height = canopy_height_band(dominant_pft, band,
+                                               height_var=surface_dataset.variables['MONTHLY_HEIGHT_TOP'])
+        results.update(vegetation_band(dominant_pft, pct_nat_pft, inputs.parameter_table, canopy_height,
+                                       inputs.weighted))
+    if SOIL in stages:
+        # COLUMNS: PAR dry, NIR dry, PAR saturated, NIR saturated
+        albedos = soil_albedo_kernel(surface_dataset.variables['SOIL_COLOR'][band, :])
+        for name, column in SOIL_VARIABLES:
+            results[name] = albedos[:, :, column]
+        if inputs.soil_moisture is not None:
+            # the saturated part of the buffer is reused for the blended albedos
+            results['PAR_albedo_wet'] = results['PAR_albedo_wet'].copy()
+            results['NIR_albedo_wet'] = results['NIR_albedo_wet'].copy()
+            blended = blend_soil_moisture(albedos, inputs.soil_moisture)
+            results['PAR_albedo'] = blended[:, :, 0]
+            results['NIR_albedo'] = blended[:, :, 1]
+    return results
+
+def band_variables(stages, top_k=1, soil_moisture=None):
+    """(name, dtype) of the variables written band by band, per stage, in write order."""
+    variables = {}
+    if DOMINANT_PFT in stages:
+        variables[DOMINANT_PFT] = [("dominant_PFT", np.int32)]
+        if top_k > 1:
+            variables[DOMINANT_PFT] += [("dominant_PFT_fraction", np.float32), ("second_PFT", np.int32),
+                                        ("second_PFT_fraction", np.float32)]
+    if VEGETATION in stages:
+        variables[VEGETATION] = [(name, np.float32) for name in VEGETATION_VARIABLES]
+    if SOIL in stages:
+        variables[SOIL] = [(name, np.float32) for name, _ in SOIL_VARIABLES]
+        if soil_moisture is not None:
+            variables[SOIL] += [('PAR_albedo', np.float32), ('NIR_albedo', np.float32)]
+    return variables
+
+def write_band(outputs, variables, band, results):
+    """Write the results of compute_band for the rows in band into the outputs of every stage."""
+    for stage, output in outputs.items():
+        for name, _ in variables[stage]:
+            output.variables[name][band, :] = results[name]
+
+def create_dominant_output(path, n_lat, n_lon):
+    """Create the dominant PFT output with its 2D coordinate variables."""
+    ds_out = nc.Dataset(path, "w", format="NETCDF4")
+    ds_out.createDimension("lat", n_lat)
+    ds_out.createDimension("lon", n_lon)
+    ds_out.createVariable("LATIXY", np.float64, ("lat", "lon"))
+    ds_out.createVariable("LONGXY", np.float64, ("lat", "lon"))
+    return ds_out
+
+def define_dominant_variables(ds_out, top_k=1):
+    """Define the PFT variables, once the coordinates have been written.
+
+    The coordinates are written first so that the file layout is the same as
+    when all variables were written at once.
+    """
+    dominant_PFT_var = ds_out.createVariable("dominant_PFT", np.int32, ("lat", "lon"))
+    dominant_PFT_var.long_name = "dominant plant functional type"
+    dominant_PFT_var.units = "index"
+    if top_k > 1:
+        dominant_fraction_var = ds_out.createVariable("dominant_PFT_fraction", np.float32, ("lat", "lon"), fill_value=np.nan)
+        dominant_fraction_var.long_name = "fraction of natural vegetation covered by the dominant plant functional type"
+        dominant_fraction_var.units = "fraction"
+
+        second_PFT_var = ds_out.createVariable("second_PFT", np.int32, ("lat", "lon"))
+        second_PFT_var.long_name = "second most common plant functional type"
+        second_PFT_var.units = "index"
+
+        second_fraction_var = ds_out.createVariable("second_PFT_fraction", np.float32, ("lat", "lon"), fill_value=np.nan)
+        second_fraction_var.long_name = "fraction of natural vegetation covered by the second plant functional type"
+        second_fraction_var.units = "fraction"
+
+def finish_dominant_output(ds_out):
+    ds_out.title = "Dominant Plant Functional Type per Gridcell"
+    ds_out.source = "Generated from PCT_NAT_PFT in surfdata_0.9x1.25_16pfts__CMIP6_simyr2000_c170616.nc"
+    ds_out.Conventions = "CF-1.8"
+    ds_out.close()
+
+def create_mapped_output(path, latitudes, longitudes, variables):
+    """Create an output with 1D coordinates and float32 (lat, lon) variables."""
+    output_dataset = nc.Dataset(path, 'w', format='NETCDF4')
+    output_dataset.createDimension('lat', len(latitudes))
+    output_dataset.createDimension('lon', len(longitudes))
+    lat_var = output_dataset.createVariable('lat', 'f4', ('lat',))
+    lon_var = output_dataset.createVariable('lon', 'f4', ('lon',))
+    for name in variables:
+        output_dataset.createVariable(name, 'f4', ('lat', 'lon',), fill_value=np.nan)
+    lat_var[:] = latitudes
+    lon_var[:] = longitudes
+    return output_dataset
+
+def finish_mapped_output(output_dataset, attributes):
+    for name, attribute, value in attributes:
+        output_dataset.variables[name].setncattr(attribute, value)
+    output_dataset.close()
+
+def process_surface_data(surface_dataset, output_dir='.', stages=STAGES, parameter_table=None,
+                         coarse_heights=None, top_k=1, band_rows=None, max_memory=None,
+                         soil_moisture=None, weighted=False, height_remap='nearest',
+                         remap_cache=DEFAULT_CACHE_DIR, workers=1):
+    """Write the outputs of stages for one surface data file into output_dir.
+
+    parameter_table is needed by the vegetation stage. If coarse_heights is
+    given, the canopy heights are taken from it instead of surface_dataset,
+    with the 'nearest' or 'conservative' height_remap. The remap indices are
+    cached in remap_cache. If weighted, the vegetation parameters are
+    PCT_NAT_PFT-weighted means. With more than one worker, the bands are
+    computed in that many processes.
+    """
+    lat_in = surface_dataset.variables['LATIXY']
+    lon_in = surface_dataset.variables['LONGXY']
+    pct_nat_pft_var = surface_dataset.variables['PCT_NAT_PFT']
+    height_var = None
+    if VEGETATION in stages and coarse_heights is None:
+        height_var = surface_dataset.variables['MONTHLY_HEIGHT_TOP']
+    natpft, n_lat, n_lon = pct_nat_pft_var.shape
+    print("Dimensions of PCT_NAT_PFT:", pct_nat_pft_var.shape)
+
+    n_height_values = 0 if height_var is None else np.prod(height_var.shape[:2])
+    rows = rows_per_band(n_lat, bytes_per_row(n_lon, natpft, n_height_values, stages, top_k, weighted),
+                         band_rows, max_memory)
+    paths = {stage: os.path.join(output_dir, OUTPUT_FILES[stage]) for stage in stages}
+    dominant_output = vegetation_output = soil_output = None
+    if DOMINANT_PFT in stages:
+        dominant_output = create_dominant_output(paths[DOMINANT_PFT], n_lat, n_lon)
+
+    # Read the coordinates once: copy them to the dominant PFT output and
+    # average them to get 1D lat/lon. The longitudes are summed row by row, in
+    # the same order as np.mean(lon, axis=0) would.
+    # The first column and row are kept to remap the coarse canopy heights,
+    # if the grid is rectilinear.
+    latitudes = np.empty(n_lat)
+    longitudes_sum = None
+    lat_rows = np.empty(n_lat)
+    lon_columns = None
+    rectilinear = True
+    for band in latitude_bands(n_lat, rows):
+        lat_band = lat_in[band, :]
+        lon_band = lon_in[band, :]
+        lat_rows[band] = np.ma.getdata(lat_band)[:, 0]
+        if lon_columns is None:
+            lon_columns = np.ma.getdata(lon_band)[0].copy()
+        rectilinear = (rectilinear and np.all(np.ma.getdata(lat_band) == lat_rows[band, None])
+                       and np.all(np.ma.getdata(lon_band) == lon_columns))
+        if dominant_output is not None:
+            dominant_output.variables["LATIXY"][band, :] = lat_band
+            dominant_output.variables["LONGXY"][band, :] = lon_band
+        latitudes[band] = np.mean(lat_band, axis=1)
+        for lon_row in lon_band:
+            longitudes_sum = lon_row.copy() if longitudes_sum is None else longitudes_sum + lon_row
+    longitudes = longitudes_sum / n_lat
+
+    if dominant_output is not None:
+        define_dominant_variables(dominant_output, top_k)
+    if VEGETATION in stages:
+        vegetation_output = create_mapped_output(paths[VEGETATION], latitudes, longitudes, VEGETATION_VARIABLES)
+    nearest = conservative = None
+    if vegetation_output is not None and coarse_heights is not None and rectilinear:
+        if height_remap == 'conservative':
+            weights = conservative_remap(coarse_heights.lat, coarse_heights.lon, lat_rows, lon_columns, remap_cache)
+            lat_matrix, lon_matrix = conservative_matrices(weights, n_lat, n_lon, len(coarse_heights.lat),
+                                                           len(coarse_heights.lon))
+            mean_heights = np.ma.masked_invalid(coarse_heights.values.mean(axis=0))
+            valid_heights = (~np.ma.getmaskarray(mean_heights)).astype(np.float64)
+            conservative = (lat_matrix, lon_matrix, np.ma.filled(mean_heights, 0.0), valid_heights)
+        else:
+            nearest = nearest_remap(coarse_heights.lat, coarse_heights.lon, lat_rows, lon_columns, remap_cache)
+    elif vegetation_output is not None and coarse_heights is not None and height_remap == 'conservative':
+        raise ValueError("Conservative remapping of the canopy heights needs a rectilinear grid")
+    variables = band_variables(stages, top_k, soil_moisture)
+    if SOIL in stages:
+        soil_output = create_mapped_output(paths[SOIL], latitudes, longitudes,
+                                           [name for name, _ in variables[SOIL]])
+
+    outputs = {DOMINANT_PFT: dominant_output, VEGETATION: vegetation_output, SOIL: soil_output}
+    outputs = {stage: output for stage, output in outputs.items() if output is not None}
+    inputs = BandInputs(stages, top_k, weighted, soil_moisture, parameter_table, coarse_heights,
+                        nearest, conservative)
+    write = lambda band, results: write_band(outputs, variables, band, results)
+    if workers > 1:
+        map_bands(surface_dataset.filepath(), inputs, compute_band,
+                  [variable for stage in stages for variable in variables[stage]],
+                  n_lat, n_lon, rows, workers, write)
+    else:
+        for band in latitude_bands(n_lat, rows):
+            write(band, compute_band(surface_dataset, inputs, band))
+
+    if dominant_output is not None:
+        finish_dominant_output(dominant_output)
+        print("NetCDF file with dominant PFT per gridcell has been created:", paths[DOMINANT_PFT])
+    if vegetation_output is not None:
+        attributes = list(VEGETATION_ATTRIBUTES)
+        if weighted:
+            attributes += [(name, 'pft_weighting', 'mean over the PFTs weighted by PCT_NAT_PFT')
+                           for name in PARAMETER_NAMES]
+        finish_mapped_output(vegetation_output, attributes)
+        print(f"NetCDF file '{paths[VEGETATION]}' created successfully.")
+    if soil_output is not None:
+        attributes = list(SOIL_ATTRIBUTES)
+        if soil_moisture is not None:
+            attributes += [
+                ('PAR_albedo', 'units', "[0 to 1]"),
+                ('PAR_albedo', 'long_name', f"PAR albedo at volumetric soil moisture {soil_moisture}"),
+                ('NIR_albedo', 'units', "[0 to 1]"),
+                ('NIR_albedo', 'long_name', f"NIR albedo at volumetric soil moisture {soil_moisture}"),
+            ]
+        finish_mapped_output(soil_output, attributes)
+        print(f"NetCDF file '{paths[SOIL]}' created successfully.")
+
+def read_parameter_table():
+    with nc.Dataset(CLM_PARAMS_FILE, 'r') as clm_params_dataset, \
+            nc.Dataset(PFT_PHYSIOLOGY_FILE, 'r') as pft_physiology_dataset:
+        return build_parameter_table(clm_params_dataset, pft_physiology_dataset)
+
+def run(output_dirs, stages=STAGES, **kwargs):
+    """Process the surface data of every resolution in output_dirs.
+
+    output_dirs maps LOWRES and/or HIGHRES to the directory of their outputs.
+    The remaining keyword arguments are passed to process_surface_data.
+    """
+    parameter_table = read_parameter_table() if VEGETATION in stages else None
+    datasets = {}
+    try:
+        for resolution in output_dirs:
+            datasets[resolution] = nc.Dataset(SURFACE_FILES[resolution], 'r')
+        coarse_heights = None
+        if HIGHRES in output_dirs and VEGETATION in stages:
+            # the 0.125x0.125 file has all `MONTHLY_HEIGHT_TOP` values of zero everywhere, so we use the 0.9x1.25 file
+            if LOWRES not in datasets:
+                datasets[LOWRES] = nc.Dataset(SURFACE_FILES[LOWRES], 'r')
+            coarse_heights = read_coarse_heights(datasets[LOWRES])
+        for resolution, output_dir in output_dirs.items():
+            os.makedirs(output_dir, exist_ok=True)
+            process_surface_data(
+                datasets[resolution], output_dir, stages, parameter_table,
+                coarse_heights if resolution == HIGHRES else None, **kwargs,
+            )
+    finally:
+        for dataset in datasets.values():
+            dataset.close()
+
+def add_remap_arguments(parser):
+    """Add the options for mapping the 0.9x1.25 canopy heights to the 0.125x0.125 grid."""
+    parser.add_argument('--height-remap', choices=['nearest', 'conservative'], default='nearest',
+                        help="map the 0.9x1.25 canopy heights from the nearest cell, or with conservative area weights")
+    parser.add_argument('--remap-cache', default=DEFAULT_CACHE_DIR,
+                        help="directory where the remap indices between grids are cached; pass '' to disable the cache")
+
+def main():
+    parser = argparse.ArgumentParser(description='Create the clm_data artifact files for both resolutions')
+    parser.add_argument('--output-dir', default=None,
+                        help=f"directory for the {LOWRES} outputs; this resolution is skipped if not given")
+    parser.add_argument('--output-dir-highres', default=None,
+                        help=f"directory for the {HIGHRES} outputs; this resolution is skipped if not given")
+    parser.add_argument('-k', '--top-k', type=int, default=1, choices=[1, 2],
+                        help="also write the second most common PFT and the fractions of both")
+    parser.add_argument('--soil-moisture', type=float, default=None,
+                        help="also write the PAR and NIR albedos at this volumetric soil moisture of the top soil layer")
+    parser.add_argument('-w', '--weighted', action='store_true',
+                        help="average the PFT parameters weighted by PCT_NAT_PFT instead of using the dominant PFT")
+    add_remap_arguments(parser)
+    add_band_arguments(parser)
+    args = parser.parse_args()
+
+    output_dirs = {}
+    if args.output_dir is not None:
+        output_dirs[LOWRES] = args.output_dir
+    if args.output_dir_highres is not None:
+        output_dirs[HIGHRES] = args.output_dir_highres
+    if not output_dirs:
+        parser.error("at least one of --output-dir and --output-dir-highres is required")
+    run(output_dirs, top_k=args.top_k, band_rows=args.band_rows, max_memory=args.max_memory,
+        soil_moisture=args.soil_moisture, weighted=args.weighted, height_remap=args.height_remap,
+        remap_cache=args.remap_cache or None, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
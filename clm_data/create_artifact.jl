@@ -14,8 +14,6 @@ const FILE_PATHS = [
     "pft-physiology.c110225.nc",
     "clm5_params.c171117.nc",
 ]
-const OUTPUT_FILES =
-    ["dominant_PFT_map.nc", "vegetation_properties_map.nc", "soil_properties_map.nc"]
 
 output_dir = basename(@__DIR__) * "_0.9x1.25_artifact"
 output_dir_highres = basename(@__DIR__) * "_0.125x0.125_artifact"
@@ -43,29 +41,10 @@ for (file_path, file_url) in zip(FILE_PATHS, FILE_URLS)
     end
 end
 
-for output_file in OUTPUT_FILES
-    isfile(output_file) && rm(output_file)
-end
-
-run(`python dominant_pft.py`)
-run(`python pft_variables.py`)
-run(`python soil_variables.py`)
-
-for output_file in OUTPUT_FILES
-    output_path = joinpath(output_dir, output_file)
-    # set force to true to overwrite existing output files
-    Base.mv(output_file, output_path; force = true)
-end
-
-run(`python dominant_pft.py -d`)
-run(`python pft_variables.py -d`)
-run(`python soil_variables.py -d`)
-
-for output_file in OUTPUT_FILES
-    output_path = joinpath(output_dir_highres, output_file)
-    # set force to true to overwrite existing output files
-    Base.mv(output_file, output_path; force = true)
-end
+# A single python process computes the dominant PFT, vegetation and soil maps for
+# both resolutions, reading each input file once, and writes them into the output
+# directories
+run(`python clm_pipeline.py --output-dir $output_dir --output-dir-highres $output_dir_highres`)
 
 create_artifact_guided(output_dir; artifact_name = basename(@__DIR__) * "_0.9x1.25")
 
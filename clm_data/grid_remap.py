@@ -0,0 +1,176 @@
+"""
+Remap indices between two rectilinear (lat, lon) grids.
+
+The nearest-neighbour index of every target row and column in the source grid
+is found with a binary search on the sorted source coordinates, and saved in a
+cache directory under a hash of both grids. Later runs on the same pair of
+grids, from any artifact, load the indices instead of searching again.
+Optionally, conservative area weights between the two grids are computed and
+cached the same way.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = 'remap_cache'
+# Increase when the content of the cached files changes
+CACHE_VERSION = 2
+
+def nearest_indices(source, target):
+    """Index of the nearest source coordinate for every target coordinate.
+
+    Same result as np.argmin(np.abs(source - t)) for every t in target, ties
+    going to the lowest index, but in O((N + M) log N) instead of O(N M).
+    """
+    source = np.asarray(source, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    order = np.argsort(source, kind='stable')
+    sorted_source = source[order]
+    position = np.searchsorted(sorted_source, target)
+    # position is the first of a run of equal coordinates, and so is left after
+    # the second search, so that order gives their lowest index
+    right = np.clip(position, 0, len(source) - 1)
+    left = np.clip(position - 1, 0, len(source) - 1)
+    left = np.searchsorted(sorted_source, sorted_source[left])
+    left_distance = np.abs(sorted_source[left] - target)
+    right_distance = np.abs(sorted_source[right] - target)
+    return np.where(
+        left_distance < right_distance, order[left],
+        np.where(right_distance < left_distance, order[right], np.minimum(order[left], order[right])),
+    )
+
+def cell_edges(centers, lower=None, upper=None):
+    """Edges of the cells around sorted centers, halfway between neighbours.
+
+    The outer edges are extrapolated by half a cell, and clipped to lower and
+    upper if given.
+    """
+    centers = np.asarray(centers, dtype=np.float64)
+    middle = (centers[1:] + centers[:-1]) / 2
+    edges = np.concatenate([[2 * centers[0] - middle[0]], middle, [2 * centers[-1] - middle[-1]]])
+    return np.clip(edges, lower, upper) if lower is not None or upper is not None else edges
+
+def is_global_longitude(centers):
+    """Whether evenly spread longitude centers go around the whole circle."""
+    centers = np.asarray(centers, dtype=np.float64)
+    if len(centers) < 2:
+        return False
+    return (centers[-1] - centers[0]) * len(centers) / (len(centers) - 1) >= 360 - 1e-6
+
+def periodic_lon_edges(centers):
+    """Edges of the cells around sorted global longitude centers, and their source cell.
+
+    The edge between the last and the first cell is halfway between them
+    across 360 degrees. The cells are repeated 360 degrees below and above,
+    so that any target cell within a turn of the grid is covered. Returns
+    (edges, cell), with cell[i] the index of the center of cell i.
+    """
+    centers = np.asarray(centers, dtype=np.float64)
+    middle = (centers[1:] + centers[:-1]) / 2
+    first = (centers[-1] - 360 + centers[0]) / 2
+    edges = np.concatenate([[first], middle, [first + 360]])
+    edges = np.concatenate([edges[:-1] - 360, edges[:-1], edges + 360])
+    return edges, np.arange(3 * len(centers)) % len(centers)
+
+def overlap_weights(source_edges, target_edges, measure=None):
+    """Fraction of every target cell covered by every overlapping source cell.
+
+    Both edge arrays must be increasing. measure maps coordinates to the
+    quantity that is integrated, e.g. np.sin of the latitude for area weights;
+    the default is the coordinate itself. Returns (target, source, weight)
+    arrays listing the nonzero overlaps, found by merging the sorted edges.
+    """
+    measure = measure if measure is not None else (lambda x: x)
+    source_edges = np.asarray(source_edges, dtype=np.float64)
+    target_edges = np.asarray(target_edges, dtype=np.float64)
+    # Every piece of the merged edges lies in exactly one source and one target cell
+    edges = np.union1d(source_edges, target_edges)
+    edges = edges[(edges >= max(source_edges[0], target_edges[0])) & (edges <= min(source_edges[-1], target_edges[-1]))]
+    middle = (edges[1:] + edges[:-1]) / 2
+    source = np.searchsorted(source_edges, middle) - 1
+    target = np.searchsorted(target_edges, middle) - 1
+    piece = np.abs(measure(edges[1:]) - measure(edges[:-1]))
+    target_size = np.abs(measure(target_edges[1:]) - measure(target_edges[:-1]))
+    keep = piece > 0
+    return target[keep], source[keep], piece[keep] / target_size[target[keep]]
+
+def grid_hash(*arrays, method='nearest'):
+    """Hash identifying a pair of grids and the remap method."""
+    digest = hashlib.sha256(f"{method}:{CACHE_VERSION}".encode())
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()[:32]
+
+def _cached(cache_dir, key, compute):
+    """Load the arrays saved under key in cache_dir, or compute and save them."""
+    if cache_dir is None:
+        return compute()
+    path = os.path.join(cache_dir, f"{key}.npz")
+    if os.path.isfile(path):
+        with np.load(path) as cached:
+            return tuple(cached[f"a{i}"] for i in range(len(cached.files)))
+    arrays = compute()
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary name first so that an interrupted run leaves no partial file
+    temporary_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(temporary_path, **{f"a{i}": array for i, array in enumerate(arrays)})
+    os.replace(temporary_path, path)
+    return arrays
+
+def nearest_remap(source_lat, source_lon, target_lat, target_lon, cache_dir=DEFAULT_CACHE_DIR):
+    """Row and column of the nearest source cell for every target row and column.
+
+    All coordinates are 1D. Returns (lat_index, lon_index), so that
+    values[lat_index[:, None], lon_index[None, :]] maps source values to the
+    target grid. The indices are cached in cache_dir, unless it is None.
+    """
+    key = grid_hash(source_lat, source_lon, target_lat, target_lon, method='nearest')
+    return _cached(cache_dir, key, lambda: (
+        nearest_indices(source_lat, target_lat),
+        nearest_indices(source_lon, target_lon),
+    ))
+
+def conservative_remap(source_lat, source_lon, target_lat, target_lon, cache_dir=DEFAULT_CACHE_DIR):
+    """Area weights of the source cells overlapping every target cell.
+
+    The coordinates are increasing 1D cell centers. Returns (lat_target,
+    lat_source, lat_weight, lon_target, lon_source, lon_weight): the weights
+    along each axis, whose products are the area weights on the sphere. If
+    the source longitudes go around the globe, they are periodic, so that
+    target cells across the dateline or the first source edge are covered.
+    """
+    key = grid_hash(source_lat, source_lon, target_lat, target_lon, method='conservative')
+    def compute():
+        lat_overlap = overlap_weights(cell_edges(source_lat, -90, 90), cell_edges(target_lat, -90, 90),
+                                      measure=lambda lat: np.sin(np.deg2rad(lat)))
+        if is_global_longitude(source_lon):
+            source_edges, cell = periodic_lon_edges(source_lon)
+            lon_target, lon_source, lon_weight = overlap_weights(source_edges, cell_edges(target_lon))
+            # the overlaps with the same cell in different turns add up in conservative_matrices
+            lon_overlap = (lon_target, cell[lon_source], lon_weight)
+        else:
+            lon_overlap = overlap_weights(cell_edges(source_lon), cell_edges(target_lon))
+        return lat_overlap + lon_overlap
+    return _cached(cache_dir, key, compute)
+
+def conservative_matrices(weights, n_target_lat, n_target_lon, n_source_lat, n_source_lon):
+    """Dense (target, source) weight matrices along lat and lon from conservative_remap.
+
+    values on the source grid are remapped with lat_matrix @ values @ lon_matrix.T,
+    and a band of target rows with lat_matrix[band] instead. The rows are
+    normalized by the part of the target cell that is covered; target cells
+    outside the source grid are NaN.
+    """
+    lat_target, lat_source, lat_weight, lon_target, lon_source, lon_weight = weights
+    lat_matrix = np.zeros((n_target_lat, n_source_lat))
+    np.add.at(lat_matrix, (lat_target, lat_source), lat_weight)
+    lon_matrix = np.zeros((n_target_lon, n_source_lon))
+    np.add.at(lon_matrix, (lon_target, lon_source), lon_weight)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        lat_matrix /= lat_matrix.sum(axis=1, keepdims=True)
+        lon_matrix /= lon_matrix.sum(axis=1, keepdims=True)
+    return lat_matrix, lon_matrix
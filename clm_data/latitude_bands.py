@@ -0,0 +1,40 @@
+import re
+
+MEMORY_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+DEFAULT_BAND_ROWS = 64
+
+def parse_memory(text):
+    """Convert a memory size such as '512M' or '2G' to a number of bytes."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", text, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Cannot parse memory size '{text}', use e.g. 512M or 2G")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2).upper()])
+
+def rows_per_band(nlat, bytes_per_row, band_rows=None, max_memory=None):
+    """Number of latitude rows to process at once.
+
+    band_rows is used as given; otherwise the rows are chosen so that one band
+    takes at most max_memory bytes. With neither, DEFAULT_BAND_ROWS is used.
+    """
+    if band_rows is not None:
+        rows = band_rows
+    elif max_memory is not None:
+        rows = max_memory // bytes_per_row
+    else:
+        rows = DEFAULT_BAND_ROWS
+    return max(1, min(rows, nlat))
+
+def latitude_bands(nlat, rows):
+    """Yield slices covering range(nlat) in consecutive bands of rows."""
+    for start in range(0, nlat, rows):
+        yield slice(start, min(start + rows, nlat))
+
+def add_band_arguments(parser):
+    """Add the --band-rows, --max-memory and --workers options shared by the scripts."""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--band-rows', type=int, default=None,
+                       help=f"number of latitude rows processed at once (default {DEFAULT_BAND_ROWS})")
+    group.add_argument('--max-memory', type=parse_memory, default=None,
+                       help="choose the band size so that one band uses at most this much memory, e.g. 2G")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes computing latitude bands in parallel")
@@ -0,0 +1,140 @@
+"""
+Compute latitude bands of the clm_data outputs in a pool of worker processes.
+
+The large input arrays are copied once into shared memory, and the workers
+attach to them instead of receiving pickled copies. Every worker opens the
+surface data itself and writes the outputs of its bands into shared output
+buffers covering a window of consecutive bands. The main process then writes
+each window into the NetCDF variables, in order, so the output files are the
+same as when the bands are computed one after the other.
+"""
+
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import netCDF4 as nc
+import numpy as np
+
+from latitude_bands import latitude_bands
+
+# Arrays smaller than this are pickled as usual
+MIN_SHARED_BYTES = 1 << 16
+
+SharedArray = namedtuple('SharedArray', ['name', 'shape', 'dtype'])
+SharedMaskedArray = namedtuple('SharedMaskedArray', ['data', 'mask'])
+
+class SharedArrays:
+    """Owner of the shared memory blocks handed to the workers."""
+
+    def __init__(self):
+        self.blocks = []
+
+    def empty(self, shape, dtype):
+        """Allocate an array in shared memory; returns its descriptor and the array."""
+        dtype = np.dtype(dtype)
+        block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        self.blocks.append(block)
+        return SharedArray(block.name, tuple(shape), dtype.str), np.ndarray(shape, dtype, buffer=block.buf)
+
+    def share(self, obj):
+        """Replace the large arrays in obj, possibly nested in tuples, by shared copies."""
+        if isinstance(obj, np.ma.MaskedArray):
+            mask = np.ma.getmask(obj)
+            return SharedMaskedArray(self.share(np.ma.getdata(obj)),
+                                     None if mask is np.ma.nomask else self.share(mask))
+        if isinstance(obj, np.ndarray):
+            if obj.nbytes < MIN_SHARED_BYTES:
+                return obj
+            descriptor, array = self.empty(obj.shape, obj.dtype)
+            array[...] = obj
+            return descriptor
+        if isinstance(obj, tuple):
+            items = [self.share(item) for item in obj]
+            return type(obj)(*items) if hasattr(obj, '_fields') else tuple(items)
+        return obj
+
+    def close(self):
+        for block in self.blocks:
+            try:
+                block.close()
+            except BufferError:
+                # arrays of the main process still point to the block; it is
+                # released with them
+                pass
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Shared memory blocks attached by this process, by name
+_attached = {}
+
+def attach(obj):
+    """Inverse of SharedArrays.share, in a worker process."""
+    if isinstance(obj, SharedMaskedArray):
+        mask = np.ma.nomask if obj.mask is None else attach(obj.mask)
+        return np.ma.masked_array(attach(obj.data), mask=mask, copy=False)
+    if isinstance(obj, SharedArray):
+        if obj.name not in _attached:
+            _attached[obj.name] = shared_memory.SharedMemory(name=obj.name)
+        return np.ndarray(obj.shape, np.dtype(obj.dtype), buffer=_attached[obj.name].buf)
+    if isinstance(obj, tuple):
+        items = [attach(item) for item in obj]
+        return type(obj)(*items) if hasattr(obj, '_fields') else tuple(items)
+    return obj
+
+# State of a worker process, set by _init_worker
+_worker = {}
+
+def _init_worker(surface_path, inputs, compute):
+    _worker['dataset'] = nc.Dataset(surface_path, 'r')
+    _worker['inputs'] = attach(inputs)
+    _worker['compute'] = compute
+
+def _run_tile(band, offset, buffers):
+    results = _worker['compute'](_worker['dataset'], _worker['inputs'], band)
+    rows = slice(offset, offset + band.stop - band.start)
+    for name, descriptor in buffers.items():
+        buffer = attach(descriptor)
+        value = results[name]
+        if np.ma.isMaskedArray(value):
+            # masked values are written as the NaN fill value of the output variables
+            value = value.filled(np.nan if buffer.dtype.kind == 'f' else 0)
+        buffer[rows] = value
+
+def map_bands(surface_path, inputs, compute, variables, n_lat, n_lon, rows, workers, write):
+    """Compute all the latitude bands of rows rows with compute, in workers processes.
+
+    compute(surface_dataset, inputs, band) returns a dict with an array for
+    each (name, dtype) in variables; it must be a module level function.
+    inputs may contain arrays, which are shared with the workers. After every
+    window of workers bands, write(window, results) is called in this process,
+    in order of latitude, with the results of the rows in the window.
+    """
+    window_rows = rows * workers
+    with SharedArrays() as shared:
+        shared_inputs = shared.share(inputs)
+        descriptors = {}
+        buffers = {}
+        for name, dtype in variables:
+            descriptors[name], buffers[name] = shared.empty((window_rows, n_lon), dtype)
+        # spawn rather than fork, since the HDF5 library of the open output files is not fork safe
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(surface_path, shared_inputs, compute)) as pool:
+            for start in range(0, n_lat, window_rows):
+                window = slice(start, min(start + window_rows, n_lat))
+                tiles = [slice(window.start + band.start, window.start + band.stop)
+                         for band in latitude_bands(window.stop - window.start, rows)]
+                futures = [pool.submit(_run_tile, tile, tile.start - window.start, descriptors) for tile in tiles]
+                for future in futures:
+                    future.result()
+                size = window.stop - window.start
+                write(window, {name: buffer[:size] for name, buffer in buffers.items()})
+        del buffers
@@ -0,0 +1,67 @@
+import numpy as np
+
+# Parameters mapped from the PFT of each gridcell, in the column order of the
+# parameter table. Each entry is (output name, input file, input variable).
+CLM_PARAMS = "clm_params"
+PFT_PHYSIOLOGY = "pft_physiology"
+PARAMETERS = [
+    ("medlynslope", CLM_PARAMS, "medlynslope"),
+    ("medlynintercept", CLM_PARAMS, "medlynintercept"),
+    ("rooting_depth", CLM_PARAMS, "rootprof_beta"),
+    ("rholnir", PFT_PHYSIOLOGY, "rholnir"),
+    ("rholvis", PFT_PHYSIOLOGY, "rholvis"),
+    ("taulnir", PFT_PHYSIOLOGY, "taulnir"),
+    ("taulvis", PFT_PHYSIOLOGY, "taulvis"),
+    ("tausnir", PFT_PHYSIOLOGY, "tausnir"),
+    ("tausvis", PFT_PHYSIOLOGY, "tausvis"),
+    ("vcmx25", PFT_PHYSIOLOGY, "vcmx25"),
+    ("xl", PFT_PHYSIOLOGY, "xl"),
+]
+PARAMETER_NAMES = [name for name, _, _ in PARAMETERS]
+
+def build_parameter_table(clm_params_dataset, pft_physiology_dataset):
+    """Read every parameter once into a dense (n_pft, n_params) float64 table.
+
+    The table has one row per PFT present in all the input variables, and one
+    column per entry of PARAMETERS. Masked parameter values become NaN.
+    """
+    datasets = {CLM_PARAMS: clm_params_dataset, PFT_PHYSIOLOGY: pft_physiology_dataset}
+    columns = []
+    for name, source, variable in PARAMETERS:
+        values = datasets[source].variables[variable][:]
+        if name == "rooting_depth":
+            # convert beta parameter to rooting depth parameter for root probability distribution
+            values = (-1)/(100*np.log(values[0]))
+        columns.append(np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan))
+    n_pft = min(len(column) for column in columns)
+    return np.stack([column[:n_pft] for column in columns], axis=1)
+
+def gather_parameter_maps(table, pft_index):
+    """Map each gridcell of the integer pft_index grid to its row of table.
+
+    Returns an array of shape pft_index.shape + (n_params,). Cells whose index
+    is masked, negative or beyond the table are NaN.
+    """
+    pft_index = np.ma.asarray(pft_index)
+    index = pft_index.filled(-1)
+    valid = (index >= 0) & (index < table.shape[0])
+    # Row n_pft of the padded table is all NaN and absorbs the invalid cells
+    padded = np.vstack([table, np.full((1, table.shape[1]), np.nan)])
+    return padded[np.where(valid, index, table.shape[0])]
+
+def weighted_parameter_maps(table, pct_nat_pft):
+    """Average the parameters of every PFT in a cell, weighted by pct_nat_pft.
+
+    pct_nat_pft has shape (natpft, nlat, nlon); the result has shape
+    (n_params, nlat, nlon). Both sums over the PFT axis are a single tensor
+    contraction with the table. PFTs with a NaN parameter are left out of the
+    average for that parameter. Cells without any weight are NaN.
+    """
+    weights = np.ma.filled(np.ma.asarray(pct_nat_pft, dtype=np.float64), 0)
+    n_pft = min(weights.shape[0], table.shape[0])
+    weights = weights[:n_pft]
+    defined = ~np.isnan(table[:n_pft])
+    weighted_sum = np.tensordot(np.where(defined, table[:n_pft], 0), weights, axes=(0, 0))
+    total_weight = np.tensordot(defined.astype(np.float64), weights, axes=(0, 0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total_weight > 0, weighted_sum / total_weight, np.nan)
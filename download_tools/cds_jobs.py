@@ -0,0 +1,227 @@
+"""
+Run many Climate Data Store (CDS) jobs, resumably, with a bounded queue.
+
+Every job retrieves one request of a dataset into a target file. At most
+max_in_flight jobs are submitted and not yet downloaded at a time; each one is
+an asyncio task that submits its request, polls the state of the job and
+downloads its result, the blocking CDS calls running in threads. Every change
+of state is appended to a journal, a JSON lines file, so that an interrupted
+run resumes exactly where it stopped: jobs that were downloaded are skipped,
+and jobs that were submitted are polled again instead of being resubmitted.
+Failed jobs are resubmitted and failed or partial downloads are retried, with
+an exponential backoff, up to max_attempts times.
+
+    from cds_jobs import CdsClient, Job, run
+    jobs = [Job(year, dataset, request_for(year), f"{year}.nc") for year in years]
+    failed = run(jobs, CdsClient(url, key), "era5_download_journal.jsonl")
+
+The URL of the client can point to a local fake CDS, see fake_cds.py.
+"""
+
+################################################################################
+# IMPORTS                                                                      #
+################################################################################
+
+import asyncio
+import datetime
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+################################################################################
+# CONSTANTS                                                                    #
+################################################################################
+
+# Number of CDS jobs queued at the same time by the ERA5 scripts
+MAX_IN_FLIGHT = 19
+POLL_INTERVAL = 60
+MAX_ATTEMPTS = 5
+# Seconds to wait before the first retry of a job, doubled at every retry
+BACKOFF = 30
+MAX_BACKOFF = 1800
+
+# States of a job on the CDS
+READY_STATE = "successful"
+FAILED_STATES = {"failed", "rejected", "dismissed", "deleted"}
+
+################################################################################
+# CLASSES                                                                      #
+################################################################################
+
+Job = namedtuple("Job", ["name", "dataset", "request", "target"])
+
+class CdsClient:
+    """The calls to the CDS used by run_jobs, with the cdsapi package.
+
+    With url and key None, they are read from ~/.cdsapirc, as by cdsapi.
+    """
+
+    def __init__(self, url=None, key=None):
+        import cdsapi
+
+        # the CDS API client behind the cdsapi compatibility layer, which can
+        # look up a job from its request ID
+        self.client = cdsapi.Client(url=url, key=key, wait_until_complete=False,
+                                    delete=False, quiet=True, progress=False).client
+
+    def submit(self, dataset, request):
+        """Submit a request and return its request ID."""
+        return self.client.submit(dataset, **request).request_uid
+
+    def state(self, request_id):
+        """State of a job: accepted, running, successful, failed, ..."""
+        return self.client.get_remote(request_id).status
+
+    def download(self, request_id, target):
+        """Download the result of a job, raising an error if it is incomplete."""
+        self.client.get_remote(request_id).download(target)
+
+class Journal:
+    """Append-only record of the changes of state of the jobs, in a JSON lines file.
+
+    Every line has the time, the job name, its new state and details, such as
+    the request ID of a submitted job or the error of a failed attempt.
+    """
+
+    def __init__(self, path, resume=True):
+        self.path = path
+        self.records = {}
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a line cut short by the interruption of a run
+                        continue
+                    self.records.setdefault(record["job"], []).append(record)
+        self.file = open(path, "a" if resume else "w")
+
+    def history(self, name):
+        return self.records.get(name, [])
+
+    def append(self, name, state, **details):
+        record = dict(time=datetime.datetime.now().isoformat(timespec="seconds"),
+                      job=name, state=state, **details)
+        self.records.setdefault(name, []).append(record)
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+################################################################################
+# FUNCTIONS                                                                    #
+################################################################################
+
+def is_downloaded(journal, job):
+    """Whether the journal records the target of job as downloaded, and it still is."""
+    history = journal.history(job.name)
+    if not history or history[-1]["state"] != "downloaded":
+        return False
+    return (os.path.isfile(job.target)
+            and os.path.getsize(job.target) == history[-1]["size"])
+
+def submitted_request_id(journal, job):
+    """Request ID of the job submitted last, unless it has failed, been given up
+    or downloaded since, in which case the request is submitted again."""
+    for record in reversed(journal.history(job.name)):
+        if record["state"] == "submitted":
+            return record["request_id"]
+        if (record["state"] in ("abandoned", "downloaded")
+                or record["state"] == "failed" and record["stage"] == "job"):
+            return None
+    return None
+
+def backoff_delay(attempt, backoff=BACKOFF):
+    return min(backoff * 2 ** (attempt - 1), MAX_BACKOFF)
+
+async def run_job(job, client, journal, slots, poll_interval=POLL_INTERVAL,
+                  max_attempts=MAX_ATTEMPTS, backoff=BACKOFF):
+    """Retrieve one job, holding one of the slots while it is in flight.
+
+    Returns True once the target is downloaded, False after max_attempts
+    failed attempts, when the job is recorded as abandoned.
+    """
+    attempts = 0
+    async with slots:
+        request_id = submitted_request_id(journal, job)
+        while attempts < max_attempts:
+            stage = "submit"
+            try:
+                if request_id is None:
+                    request_id = await asyncio.to_thread(client.submit, job.dataset, job.request)
+                    journal.append(job.name, "submitted", request_id=request_id)
+                    print(f"{job.name}: submitted as {request_id}", flush=True)
+                stage = "poll"
+                state = await asyncio.to_thread(client.state, request_id)
+                while state != READY_STATE:
+                    if state in FAILED_STATES:
+                        stage = "job"
+                        raise RuntimeError(f"job {request_id} is {state}")
+                    await asyncio.sleep(poll_interval)
+                    state = await asyncio.to_thread(client.state, request_id)
+                stage = "download"
+                # downloaded next to the target first, so that a target file is always complete
+                partial = job.target + ".part"
+                await asyncio.to_thread(client.download, request_id, partial)
+                os.replace(partial, job.target)
+                journal.append(job.name, "downloaded", request_id=request_id,
+                               size=os.path.getsize(job.target))
+                print(f"{job.name}: downloaded to {job.target}", flush=True)
+                return True
+            except Exception as error:
+                attempts += 1
+                journal.append(job.name, "failed", stage=stage, request_id=request_id,
+                               attempt=attempts, error=f"{type(error).__name__}: {error}")
+                print(f"{job.name}: {stage} failed (attempt {attempts} of {max_attempts}): "
+                      f"{error}", flush=True)
+                if stage == "job":
+                    # the job itself failed, so it is submitted again
+                    request_id = None
+                if attempts < max_attempts:
+                    await asyncio.sleep(backoff_delay(attempts, backoff))
+    journal.append(job.name, "abandoned", request_id=request_id)
+    return False
+
+async def run_jobs(jobs, client, journal, max_in_flight=MAX_IN_FLIGHT,
+                   poll_interval=POLL_INTERVAL, max_attempts=MAX_ATTEMPTS, backoff=BACKOFF):
+    """Run all the jobs, and return the names of those that failed."""
+    # one thread per job in flight, for the blocking calls to the CDS
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_in_flight))
+    slots = asyncio.Semaphore(max_in_flight)
+    pending = []
+    for job in jobs:
+        if is_downloaded(journal, job):
+            continue
+        if not journal.history(job.name) and os.path.isfile(job.target):
+            # downloaded before the journal was started
+            journal.append(job.name, "downloaded", size=os.path.getsize(job.target), existing=True)
+            continue
+        pending.append(job)
+    print(f"{len(jobs) - len(pending)} of {len(jobs)} job(s) already downloaded", flush=True)
+    # the jobs submitted by a previous run are polled first, as they hold a place in the queue
+    pending.sort(key=lambda job: submitted_request_id(journal, job) is None)
+    results = await asyncio.gather(*(
+        run_job(job, client, journal, slots, poll_interval, max_attempts, backoff)
+        for job in pending))
+    return [job.name for job, done in zip(pending, results) if not done]
+
+def run(jobs, client, journal_path, resume=True, **options):
+    """Run all the jobs, resuming from the journal if resume, and print a summary.
+
+    Returns the names of the jobs that failed.
+    """
+    journal = Journal(journal_path, resume)
+    try:
+        failed = asyncio.run(run_jobs(jobs, client, journal, **options))
+    finally:
+        journal.close()
+    if failed:
+        print(f"{len(failed)} of {len(jobs)} job(s) failed: {', '.join(failed)} "
+              f"(see {journal_path})")
+    else:
+        print(f"All {len(jobs)} job(s) downloaded.")
+    return failed
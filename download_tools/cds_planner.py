@@ -0,0 +1,191 @@
+"""
+Split Climate Data Store (CDS) requests into chunks that the CDS accepts.
+
+A request is the dictionary passed to `cdsapi.Client.retrieve`. Its size is
+estimated as the number of fields it returns, one per variable, level, valid
+date and time, and as a number of bytes from the grid. A request larger than
+the limit is split along the axes of SPLIT_AXES, outermost first, into the
+fewest chunks of consecutive values that fit. The CDS queue runs smaller jobs
+first, so a lower limit gives more, smaller jobs that start sooner.
+
+    from cds_planner import plan
+    for chunk in plan(dataset, request):
+        client.retrieve(dataset, chunk, target)
+
+or, from the command line, with the request in a JSON file:
+
+    python cds_planner.py reanalysis-era5-single-levels request.json --max-fields 9000
+"""
+
+################################################################################
+# IMPORTS                                                                      #
+################################################################################
+
+import argparse
+import calendar
+import datetime
+import json
+import math
+
+################################################################################
+# CONSTANTS                                                                    #
+################################################################################
+
+# Largest number of fields of a chunk. The requests of the ERA5 scripts with up
+# to 35,712 fields (12 hourly variables over 4 months) are accepted, while a
+# year of them (105,408 fields) is "too large".
+DEFAULT_MAX_FIELDS = 36_000
+
+# Axes along which requests are split, in order of preference
+SPLIT_AXES = ["year", "month", "variable", "pressure_level", "model_level",
+              "day", "time"]
+
+# Keys of the request with one field per value
+LEVEL_KEYS = ["pressure_level", "model_level"]
+
+# Native grid spacing in degrees, by dataset name prefix; ERA5 otherwise
+NATIVE_GRIDS = {"reanalysis-era5-land": 0.1}
+ERA5_GRID = 0.25
+
+# Bytes per value of the output formats, before compression
+BYTES_PER_VALUE = {"grib": 2, "netcdf": 4, "netcdf_legacy": 4}
+
+################################################################################
+# FUNCTIONS                                                                    #
+################################################################################
+
+def as_list(value):
+    """Values of a request key, which may be a single value or a list."""
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+def date_count(request):
+    """Number of valid dates of a request.
+
+    Days that do not exist in a month, e.g. 31 in April, are not counted, as
+    the CDS skips them. Requests without days, e.g. of monthly means, have one
+    date per year and month.
+    """
+    if "date" in request:
+        count = 0
+        for dates in as_list(request["date"]):
+            start, _, end = str(dates).partition("/")
+            first = datetime.date.fromisoformat(start)
+            last = datetime.date.fromisoformat(end) if end else first
+            count += (last - first).days + 1
+        return count
+    years = [int(year) for year in as_list(request.get("year"))]
+    months = [int(month) for month in as_list(request.get("month"))]
+    if "day" not in request:
+        return len(years) * len(months)
+    days = [int(day) for day in as_list(request["day"])]
+    return sum(sum(day <= calendar.monthrange(year, month)[1] for day in days)
+               for year in years for month in months)
+
+def field_count(request):
+    """Number of fields (2D grids) returned by a request."""
+    levels = 1
+    for key in LEVEL_KEYS:
+        if key in request:
+            levels *= len(as_list(request[key]))
+    return (len(as_list(request.get("variable"))) * levels * date_count(request)
+            * max(len(as_list(request.get("time"))), 1)
+            * max(len(as_list(request.get("product_type"))), 1))
+
+def grid_points(dataset, request):
+    """Number of points of one field of a request."""
+    native = next((spacing for prefix, spacing in NATIVE_GRIDS.items()
+                   if dataset.startswith(prefix)), ERA5_GRID)
+    dlon, dlat = (float(spacing) for spacing in request.get("grid", [native, native]))
+    north, west, south, east = request.get("area", [90, -180, -90, 180])
+    n_lon = min(math.floor((east - west) / dlon) + 1, round(360 / dlon))
+    n_lat = math.floor((north - south) / dlat) + 1
+    return n_lon * n_lat
+
+def estimate(dataset, request):
+    """(fields, bytes) of a request, the bytes before any compression."""
+    fields = field_count(request)
+    data_format = request.get("data_format", request.get("format", "grib"))
+    return fields, fields * grid_points(dataset, request) * BYTES_PER_VALUE.get(data_format, 4)
+
+def _fits(dataset, request, max_fields, max_bytes):
+    fields, size = estimate(dataset, request)
+    return fields <= max_fields and (max_bytes is None or size <= max_bytes)
+
+def _groups(values, n_groups):
+    """Split values into n_groups groups of consecutive values of even sizes."""
+    size, extra = divmod(len(values), n_groups)
+    groups, start = [], 0
+    for i in range(n_groups):
+        end = start + size + (i < extra)
+        groups.append(values[start:end])
+        start = end
+    return groups
+
+def plan(dataset, request, max_fields=DEFAULT_MAX_FIELDS, max_bytes=None,
+         axes=SPLIT_AXES):
+    """Chunks of request of at most max_fields fields and max_bytes bytes.
+
+    The request is split along the first of axes with more than one value,
+    into the fewest groups of consecutive values that fit, each chunk being
+    split further along the next axes if even one value does not fit. The
+    chunks are returned in the order of the values of the request. Raises
+    ValueError if a chunk cannot be split below the limits.
+    """
+    if _fits(dataset, request, max_fields, max_bytes):
+        return [request]
+    for i, axis in enumerate(axes):
+        values = as_list(request.get(axis))
+        if len(values) < 2:
+            continue
+        # fewest groups of which all the chunks fit, or one value per group
+        for n_groups in range(2, len(values) + 1):
+            groups = _groups(values, n_groups)
+            if all(_fits(dataset, dict(request, **{axis: group}), max_fields, max_bytes)
+                   for group in groups):
+                break
+        chunks = []
+        for group in groups:
+            chunks += plan(dataset, dict(request, **{axis: group}), max_fields,
+                           max_bytes, axes[i + 1:])
+        return chunks
+    fields, size = estimate(dataset, request)
+    raise ValueError(f"request of {fields} fields and {size} bytes cannot be split "
+                     f"below {max_fields} fields and {max_bytes} bytes along {axes}")
+
+def describe(dataset, chunks):
+    """Lines with the size of every chunk and the total."""
+    lines = []
+    total_fields = total_bytes = 0
+    for i, chunk in enumerate(chunks, 1):
+        fields, size = estimate(dataset, chunk)
+        total_fields += fields
+        total_bytes += size
+        split = ", ".join(f"{axis}={as_list(chunk[axis])[0]}"
+                          + (f"..{as_list(chunk[axis])[-1]}" if len(as_list(chunk[axis])) > 1 else "")
+                          for axis in SPLIT_AXES if axis in chunk)
+        lines.append(f"{i:4d}: {fields:8d} fields, {size / 1e9:8.2f} GB  {split}")
+    lines.append(f"{len(chunks)} chunk(s), {total_fields} fields, {total_bytes / 1e9:.2f} GB")
+    return lines
+
+################################################################################
+# MAIN                                                                         #
+################################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split a CDS request into chunks")
+    parser.add_argument("dataset", help="e.g. reanalysis-era5-single-levels")
+    parser.add_argument("request", help="JSON file with the request")
+    parser.add_argument("--max-fields", type=int, default=DEFAULT_MAX_FIELDS)
+    parser.add_argument("--max-bytes", type=float, default=None)
+    parser.add_argument("--output", help="write the chunks to this JSON file")
+    args = parser.parse_args()
+
+    with open(args.request) as f:
+        request = json.load(f)
+    chunks = plan(args.dataset, request, args.max_fields, args.max_bytes)
+    print("\n".join(describe(args.dataset, chunks)))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(chunks, f, indent=2)
@@ -0,0 +1,168 @@
+"""
+A local fake of the Climate Data Store (CDS) retrieve API, to try the download
+scripts without queuing real jobs.
+
+It serves the requests of the CDS API client used by cdsapi: submitting a
+job, polling its state and downloading its result, a file of --size random
+bytes. Every job is accepted, then running, and then successful after --delay
+seconds, or failed with a probability of --fail-rate. A download is cut short
+with a probability of --partial-rate, as if the connection had dropped.
+
+    python fake_cds.py --port 8765 --delay 5 --fail-rate 0.2 --partial-rate 0.2
+
+and then, in another terminal, e.g.
+
+    python download_era5.py -k any-key --url http://localhost:8765/api -d downloads/
+"""
+
+################################################################################
+# IMPORTS                                                                      #
+################################################################################
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+################################################################################
+# CONSTANTS                                                                    #
+################################################################################
+
+API_PATH = "/api/retrieve/v1"
+MESSAGES_PATH = "/api/catalogue/v1/messages"
+FILES_PATH = "/files"
+
+################################################################################
+# CLASSES                                                                      #
+################################################################################
+
+class FakeCds:
+    """The jobs of the fake CDS and their outcome, drawn when they are submitted."""
+
+    def __init__(self, delay, fail_rate, partial_rate, size, seed=None):
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.partial_rate = partial_rate
+        self.size = size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def submit(self, dataset, request):
+        with self.lock:
+            job_id = str(uuid.UUID(int=self.random.getrandbits(128)))
+            self.jobs[job_id] = {
+                "dataset": dataset,
+                "request": request,
+                "submitted": time.monotonic(),
+                "fails": self.random.random() < self.fail_rate,
+            }
+        return job_id
+
+    def status(self, job_id):
+        job = self.jobs[job_id]
+        elapsed = time.monotonic() - job["submitted"]
+        if elapsed < self.delay / 2:
+            return "accepted"
+        if elapsed < self.delay:
+            return "running"
+        return "failed" if job["fails"] else "successful"
+
+    def content(self, job_id):
+        """Bytes of the result of a job, cut short for a partial download."""
+        data = random.Random(job_id).randbytes(self.size)
+        with self.lock:
+            partial = self.random.random() < self.partial_rate
+        return data[:self.size // 2] if partial else data
+
+class Handler(BaseHTTPRequestHandler):
+    cds = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, content, status=200):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def job_json(self, job_id):
+        url = f"http://{self.headers['Host']}{API_PATH}/jobs/{job_id}"
+        return {
+            "jobID": job_id,
+            "processID": self.cds.jobs[job_id]["dataset"],
+            "status": self.cds.status(job_id),
+            "metadata": {"request": {"ids": self.cds.jobs[job_id]["request"]}},
+            "links": [{"rel": "self", "href": url}, {"rel": "monitor", "href": url},
+                      {"rel": "results", "href": f"{url}/results"}],
+        }
+
+    def do_POST(self):
+        parts = self.path.split("?")[0].split("/")
+        # /api/retrieve/v1/processes/<dataset>/execution
+        if self.path.startswith(f"{API_PATH}/processes/") and parts[-1] == "execution":
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}").get("inputs", {})
+            job_id = self.cds.submit(parts[-2], request)
+            self.send_json(self.job_json(job_id), 201)
+        else:
+            self.send_json({"title": "not found"}, 404)
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        parts = path.split("/")
+        if path == MESSAGES_PATH:
+            self.send_json({"messages": []})
+        elif path.startswith(f"{API_PATH}/processes/"):
+            self.send_json({"id": parts[-1], "links": []})
+        elif path.startswith(f"{API_PATH}/jobs/") and parts[-1] == "results":
+            job_id = parts[-2]
+            if job_id not in self.cds.jobs or self.cds.status(job_id) != "successful":
+                self.send_json({"title": "results not ready"}, 404)
+                return
+            self.send_json({"asset": {"value": {
+                "href": f"http://{self.headers['Host']}{FILES_PATH}/{job_id}.nc",
+                "file:size": self.cds.size, "type": "application/netcdf"}}})
+        elif path.startswith(f"{API_PATH}/jobs/"):
+            if parts[-1] not in self.cds.jobs:
+                self.send_json({"title": "job not found"}, 404)
+                return
+            self.send_json(self.job_json(parts[-1]))
+        elif path.startswith(f"{FILES_PATH}/"):
+            data = self.cds.content(parts[-1].removesuffix(".nc"))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/netcdf")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self.send_json({"title": "not found"}, 404)
+
+################################################################################
+# MAIN                                                                         #
+################################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local fake of the CDS retrieve API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=5,
+                        help="seconds from the submission of a job to its result")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="probability that a job fails")
+    parser.add_argument("--partial-rate", type=float, default=0.0,
+                        help="probability that a download is cut short")
+    parser.add_argument("--size", type=int, default=1 << 20,
+                        help="size of the result of every job, in bytes")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    Handler.cds = FakeCds(args.delay, args.fail_rate, args.partial_rate, args.size, args.seed)
+    server = ThreadingHTTPServer(("localhost", args.port), Handler)
+    print(f"Fake CDS API at http://localhost:{args.port}/api")
+    server.serve_forever()
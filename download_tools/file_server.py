@@ -0,0 +1,125 @@
+"""
+Serve the files of a directory over HTTP, with range requests, and a Zenodo
+record listing them, to try http_download.py without downloading real data.
+
+The record, at /api/records/<--record>, has the size and MD5 checksum of
+every file, like a Zenodo record. A response is cut short with a
+probability of --drop-rate, as if the connection had dropped, and
+--no-ranges ignores range requests.
+
+    python file_server.py DIR --port 8766 --record 12768877 --drop-rate 0.2
+
+and then, in another terminal, e.g.
+
+    python download_cloudsat.py --zenodo-api http://localhost:8766/api
+"""
+
+################################################################################
+# IMPORTS                                                                      #
+################################################################################
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+################################################################################
+# CONSTANTS                                                                    #
+################################################################################
+
+RANGE_PATTERN = re.compile(r"bytes=(\d+)-(\d*)$")
+
+################################################################################
+# CLASSES                                                                      #
+################################################################################
+
+class Handler(BaseHTTPRequestHandler):
+    directory = "."
+    record = None
+    drop_rate = 0.0
+    ranges = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, content, status=200):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def record_json(self):
+        files = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not os.path.isfile(path):
+                continue
+            with open(path, "rb") as f:
+                md5 = hashlib.md5(f.read()).hexdigest()
+            files.append({
+                "key": name,
+                "size": os.path.getsize(path),
+                "checksum": f"md5:{md5}",
+                "links": {"self": f"http://{self.headers['Host']}/files/{name}"},
+            })
+        return {"id": self.record, "files": files}
+
+    def send_file(self, name):
+        path = os.path.join(self.directory, os.path.basename(name))
+        if not os.path.isfile(path):
+            self.send_json({"message": "not found"}, 404)
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        match = RANGE_PATTERN.match(self.headers.get("Range", ""))
+        if self.ranges and match:
+            start = int(match[1])
+            end = min(int(match[2]) + 1 if match[2] else len(data), len(data))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(data)}")
+        else:
+            start, end = 0, len(data)
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        if random.random() < self.drop_rate:
+            # half of the bytes, and the connection is closed
+            end = start + (end - start) // 2
+            self.close_connection = True
+        self.wfile.write(data[start:end])
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == f"/api/records/{self.record}":
+            self.send_json(self.record_json())
+        elif path.startswith("/files/"):
+            self.send_file(path[len("/files/"):])
+        else:
+            self.send_json({"message": "not found"}, 404)
+
+################################################################################
+# MAIN                                                                         #
+################################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the files of a directory as a Zenodo record")
+    parser.add_argument("directory")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--record", default="12768877", help="ID of the record")
+    parser.add_argument("--drop-rate", type=float, default=0.0,
+                        help="probability that a response is cut short")
+    parser.add_argument("--no-ranges", action="store_true", help="ignore range requests")
+    args = parser.parse_args()
+
+    Handler.directory = args.directory
+    Handler.record = args.record
+    Handler.drop_rate = args.drop_rate
+    Handler.ranges = not args.no_ranges
+    server = ThreadingHTTPServer(("localhost", args.port), Handler)
+    print(f"Zenodo record {args.record} at http://localhost:{args.port}/api/records/{args.record}")
+    server.serve_forever()
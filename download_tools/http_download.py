@@ -0,0 +1,208 @@
+"""
+Download files over HTTP in parallel, resumably, and check what was received.
+
+Several files are downloaded at the same time, and a file larger than
+segment_size is split into segments downloaded in parallel with HTTP range
+requests. Every segment is written to <target>.part<i> and, after an
+interruption, resumed from the size of that file; the segments are joined
+into the target once they are all complete. The target is then checked
+against the size and checksum ("md5:...", "sha256:...", ...) of its
+Download, if known, and deleted if it does not match. A target that already
+matches is not downloaded again.
+
+    from http_download import download_all, zenodo_files
+    failed = download_all(zenodo_files("12768877"), "downloads/")
+
+The file listing and checksums of a Zenodo record come from the Zenodo API,
+whose URL can point to a local server, see file_server.py.
+"""
+
+################################################################################
+# IMPORTS                                                                      #
+################################################################################
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
+from urllib.request import Request, urlopen
+
+################################################################################
+# CONSTANTS                                                                    #
+################################################################################
+
+ZENODO_API = "https://zenodo.org/api"
+
+# Files downloaded at the same time, and HTTP connections shared by their segments
+MAX_FILES = 4
+MAX_CONNECTIONS = 8
+SEGMENT_SIZE = 64 * 1024**2
+BLOCK_SIZE = 1024**2
+TIMEOUT = 60
+MAX_ATTEMPTS = 5
+# Seconds to wait before the first retry of a segment, doubled at every retry
+BACKOFF = 2
+
+################################################################################
+# CLASSES                                                                      #
+################################################################################
+
+# size and checksum are None when they are not known
+Download = namedtuple("Download", ["url", "target", "size", "checksum"], defaults=[None, None])
+
+class ChecksumError(ValueError):
+    pass
+
+################################################################################
+# FUNCTIONS                                                                    #
+################################################################################
+
+def zenodo_files(record_id, names=None, api_url=ZENODO_API):
+    """Downloads of the files of a Zenodo record, with their size and checksum.
+
+    The targets are the file names; names, if given, selects the files.
+    """
+    with urlopen(f"{api_url}/records/{record_id}", timeout=TIMEOUT) as response:
+        record = json.load(response)
+    downloads = []
+    for entry in record["files"]:
+        if names is not None and entry["key"] not in names:
+            continue
+        url = entry.get("links", {}).get("self",
+                                         f"{api_url}/records/{record_id}/files/{entry['key']}/content")
+        downloads.append(Download(url, entry["key"], entry.get("size"), entry.get("checksum")))
+    missing = set(names or ()) - {download.target for download in downloads}
+    if missing:
+        raise FileNotFoundError(f"{', '.join(sorted(missing))} not in Zenodo record {record_id}")
+    return downloads
+
+def file_checksum(path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def verify(download, path):
+    """Raise ChecksumError if the file at path does not match the size or checksum of download."""
+    size = os.path.getsize(path)
+    if download.size is not None and size != download.size:
+        raise ChecksumError(f"{path} has {size} bytes instead of {download.size}")
+    if download.checksum is not None:
+        algorithm, _, expected = download.checksum.partition(":")
+        actual = file_checksum(path, algorithm)
+        if actual != expected:
+            raise ChecksumError(f"{path} has {algorithm} {actual} instead of {expected}")
+
+def is_downloaded(download, path):
+    """Whether path is a complete download, as far as the size and checksum tell."""
+    if not os.path.isfile(path) or download.size is None and download.checksum is None:
+        return False
+    try:
+        verify(download, path)
+    except ChecksumError:
+        return False
+    return True
+
+def remote_size(url):
+    """(size, whether the server accepts range requests) of url, from a 1-byte range request."""
+    with urlopen(Request(url, headers={"Range": "bytes=0-0"}), timeout=TIMEOUT) as response:
+        if response.status == 206:
+            # Content-Range: bytes 0-0/<size>
+            return int(response.headers["Content-Range"].rpartition("/")[2]), True
+        length = response.headers.get("Content-Length")
+        return (int(length) if length is not None else None), False
+
+def segments(size, segment_size=SEGMENT_SIZE):
+    """(start, end) byte ranges, end excluded, of the segments of a file of size bytes."""
+    return [(start, min(start + segment_size, size)) for start in range(0, size, segment_size)]
+
+def download_segment(url, path, start, end, max_attempts=MAX_ATTEMPTS, backoff=BACKOFF):
+    """Download bytes start to end (excluded) of url into path, resuming from its size."""
+    for attempt in range(1, max_attempts + 1):
+        done = os.path.getsize(path) if os.path.exists(path) else 0
+        if done > end - start:
+            # left by a run with another segment size
+            os.remove(path)
+            done = 0
+        if done == end - start:
+            return
+        try:
+            request = Request(url, headers={"Range": f"bytes={start + done}-{end - 1}"})
+            with urlopen(request, timeout=TIMEOUT) as response:
+                if response.status != 206:
+                    raise RuntimeError(f"{url} did not honor the range request")
+                with open(path, "ab") as f:
+                    shutil.copyfileobj(response, f, BLOCK_SIZE)
+            if os.path.getsize(path) != end - start:
+                raise ConnectionError(f"{path} stopped at {os.path.getsize(path)} of {end - start} bytes")
+            return
+        except (OSError, HTTPException) as error:
+            if attempt == max_attempts:
+                raise
+            print(f"{path}: {error}, retrying (attempt {attempt} of {max_attempts})", flush=True)
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+def download_whole(url, path):
+    """Download url into path in one request, for servers without range requests."""
+    with urlopen(url, timeout=TIMEOUT) as response, open(path, "wb") as f:
+        shutil.copyfileobj(response, f, BLOCK_SIZE)
+
+def download_file(download, output_dir, connections, segment_size=SEGMENT_SIZE):
+    """Download one file into output_dir, with its segments run by the connections pool.
+
+    Returns the path of the file. Raises ChecksumError, deleting the file, if it
+    does not match its Download.
+    """
+    target = os.path.join(output_dir, download.target)
+    if is_downloaded(download, target):
+        print(f"{target} already downloaded", flush=True)
+        return target
+    size, ranged = remote_size(download.url)
+    if download.size is not None and size is not None and size != download.size:
+        raise ChecksumError(f"{download.url} has {size} bytes instead of {download.size}")
+    if ranged and size:
+        parts = [f"{target}.part{i}" for i in range(len(segments(size, segment_size)))]
+        futures = [connections.submit(download_segment, download.url, part, start, end)
+                   for part, (start, end) in zip(parts, segments(size, segment_size))]
+        for future in futures:
+            future.result()
+        # the segments are appended to the first one, which becomes the target
+        with open(parts[0], "ab") as f:
+            for part in parts[1:]:
+                with open(part, "rb") as segment:
+                    shutil.copyfileobj(segment, f, BLOCK_SIZE)
+        os.replace(parts[0], target)
+        for part in parts[1:]:
+            os.remove(part)
+    else:
+        partial = f"{target}.part"
+        download_whole(download.url, partial)
+        os.replace(partial, target)
+    try:
+        verify(download, target)
+    except ChecksumError:
+        os.remove(target)
+        raise
+    print(f"{target} downloaded", flush=True)
+    return target
+
+def download_all(downloads, output_dir=".", max_files=MAX_FILES,
+                 max_connections=MAX_CONNECTIONS, segment_size=SEGMENT_SIZE):
+    """Download all the files into output_dir, and return those that failed with their error."""
+    os.makedirs(output_dir, exist_ok=True)
+    failed = []
+    with ThreadPoolExecutor(max_connections) as connections, ThreadPoolExecutor(max_files) as files:
+        futures = [files.submit(download_file, download, output_dir, connections, segment_size)
+                   for download in downloads]
+        for download, future in zip(downloads, futures):
+            try:
+                future.result()
+            except Exception as error:
+                print(f"{download.target}: download failed: {error}", flush=True)
+                failed.append((download, error))
+    return failed
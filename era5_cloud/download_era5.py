@@ -1,16 +1,20 @@
-import cdsapi
-import concurrent.futures
-import itertools
+import os
+import sys
+
+# The request planner and job orchestrator shared by the ERA5 download scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "download_tools"))
+from cds_jobs import CdsClient, Job, run
+from cds_planner import plan
 
-client = cdsapi.Client()
 dataset = "reanalysis-era5-pressure-levels"
+JOURNAL = "era5_cloud_download_journal.jsonl"
 
-def download_era5(variable, month):
-    request = {
+def cloud_request(variables, months):
+    return {
         "product_type": ["reanalysis"],
-        "variable": variable,
+        "variable": variables,
         "year": ["2010"],
-        "month": month,
+        "month": months,
         "day": [
             "01", "02", "03",
             "04", "05", "06",
@@ -53,16 +57,20 @@ def download_era5(variable, month):
         "download_format": "unarchived",
         "grid": [2.0, 2.0]
     }
-    filename = "era5_cloud_hourly_"+variable+"_2010"+month+".nc"
-    print(filename)
-    client.retrieve(dataset, request, filename)
+
+def download_job(request):
+    # one chunk is one variable for one month
+    filename = "era5_cloud_hourly_"+request["variable"][0]+"_2010"+request["month"][0]+".nc"
+    return Job(filename, dataset, request, filename)
 
 if __name__ == "__main__":
     variables = ["fraction_of_cloud_cover", "specific_cloud_ice_water_content",
                 "specific_cloud_liquid_water_content", "specific_humidity", "relative_humidity"]
     months = list(map(lambda x: str(x).zfill(2), range(1, 13)))
-    variables_all = [r[0] for r in itertools.product(variables, months)]
-    months_all = [r[1] for r in itertools.product(variables, months)]
+    # The planner splits the request into one chunk per variable and month, as a month of a
+    # single variable on all the pressure levels is the largest request accepted
+    chunks = plan(dataset, cloud_request(variables, months))
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        executor.map(download_era5, variables_all, months_all)
+    # failed requests and downloads are retried, and a rerun resumes from the journal
+    if run([download_job(chunk) for chunk in chunks], CdsClient(), JOURNAL):
+        sys.exit(1)
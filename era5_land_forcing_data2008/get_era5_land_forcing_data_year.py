@@ -1,12 +1,17 @@
-import concurrent.futures
-import cdsapi
+import os
 import sys
-from itertools import repeat
 
-def get_era5_forcing_data_for(YOUR_API_KEY, year, months):
-    """Get the ERA5 forcing data for ClimaLand for `months` from `year`."""
-    dataset = "reanalysis-era5-single-levels"
-    request = {
+# The request planner and job orchestrator shared by the ERA5 download scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "download_tools"))
+from cds_jobs import CdsClient, Job, run
+from cds_planner import plan
+
+dataset = "reanalysis-era5-single-levels"
+JOURNAL = "era5_download_journal.jsonl"
+
+def forcing_request(year, months):
+    """Request of the ERA5 forcing data for ClimaLand for `months` from `year`."""
+    return {
     "product_type": ["reanalysis"],
     "variable": [
         "10m_u_component_of_wind",
@@ -51,8 +56,11 @@ def get_era5_forcing_data_for(YOUR_API_KEY, year, months):
     "download_format": "unarchived",
     'grid'  : [1.0, 1.0]
 }
-    client = cdsapi.Client(url="https://cds.climate.copernicus.eu/api", key=YOUR_API_KEY)
-    client.retrieve(dataset, request).download()
+
+def forcing_job(year, request):
+    """Job getting the ERA5 forcing data for ClimaLand of one chunk of the request."""
+    name = f"{year}_{request['month'][0]}"
+    return Job(name, dataset, request, f"era5_{name}.nc")
 
 if __name__ == "__main__":
     API_KEY = str(sys.argv[1])
@@ -60,8 +68,11 @@ if __name__ == "__main__":
 
     print(f"API_KEY: {API_KEY}")
 
-    # Split the requests over all the months and submit them all at once; otherwise, we get the
-    # error: Your request is too large, please reduce your selection.
-    months = [["01", "02", "03","04"], ["05", "06", "07", "08"], ["09", "10", "11", "12"]]
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        executor.map(get_era5_forcing_data_for, repeat(API_KEY), repeat(year), months)
+    # Split the request and submit all the chunks at once; otherwise, we get the error: Your
+    # request is too large, please reduce your selection. The planner splits the year into
+    # three chunks of four months, one .nc file each.
+    months = ["01", "02", "03", "04", "05", "06", "07", "08", "09", "10", "11", "12"]
+    chunks = plan(dataset, forcing_request(year, months))
+    client = CdsClient(url="https://cds.climate.copernicus.eu/api", key=API_KEY)
+    if run([forcing_job(year, chunk) for chunk in chunks], client, JOURNAL):
+        sys.exit(1)
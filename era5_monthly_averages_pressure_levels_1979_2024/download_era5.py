@@ -3,15 +3,20 @@
 # See here: https://github.com/e5k/CDSAPItools/tree/main
 ############################################
 
-import cdsapi
-import pandas as pd
-import time
 import argparse
+import os
+import sys
+
+# The CDS job orchestrator shared by the ERA5 download scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "download_tools"))
+from cds_jobs import CdsClient, Job, run
 
 parser = argparse.ArgumentParser(description='Use cdsapi to download era5 mean monthly surface fluxes')
 parser.add_argument('-k', '--key', help="CDS API KEY", type=str)
-parser.add_argument('-r', '--resume', action='store_true')
+parser.add_argument('-r', '--resume', action='store_true',
+                    help="resume from the journal of the previous run")
 parser.add_argument('-d', '--dir', help="download target dir", type=str)
+parser.add_argument('--url', help="CDS API URL, e.g. of a local fake CDS", type=str)
 args = parser.parse_args()
 
 dataset = "reanalysis-era5-pressure-levels-monthly-means"
@@ -22,15 +27,9 @@ if args.dir is None:
 else:
     output_dir = args.dir
 URL = 'https://cds.climate.copernicus.eu/api'
-SLEEP_TIME = 60
-BASE_URL = "https://cds.climate.copernicus.eu/api/retrieve/v1/jobs/"
+JOURNAL = "era5_download_journal.jsonl"
 
-def submit_request(year):
-    print("Submitting Request for data for year: ", year)
-    if args.key is None:
-        submit_client = cdsapi.Client(wait_until_complete=False, delete=False)
-    else:
-        submit_client = cdsapi.Client(wait_until_complete=False, delete=False, url=URL, key=args.key)
+def year_request(year):
     request = {
     "product_type": ["monthly_averaged_reanalysis"],
     "variable": [
@@ -69,64 +68,13 @@ def submit_request(year):
     "download_format": "unarchived",
     "grid"  : [1.0, 1.0],
     }
-    r = submit_client.retrieve(dataset, request)
-    return r.reply["request_id"]
-
-
-
-# submit dummy request
-if args.key is None:
-    client = cdsapi.Client(wait_until_complete=False, delete=False)
-else:
-    client = cdsapi.Client(wait_until_complete=False, delete=False, url=URL, key=args.key)
-r = client.retrieve('reanalysis-era5-pressure-levels', {
-           "variable": "temperature",
-           "pressure_level": "1000",
-           "product_type": "reanalysis",
-           "date": "2017-12-01/2017-12-31",
-           "time": "12:00",
-           "format": "grib"
-       })
-r.retry_options["maximum_tries"] = 9999
-if args.resume:
-    df = pd.read_csv("era5_download_status.csv", index_col=0)
-else:
-    df = pd.DataFrame()
-    index = 0
-    for year in years:
-        df = pd.concat([df, pd.DataFrame({"year": year, "status": "not started", "request_id": ""}, index=[index])])
-        index += 1
-    df.to_csv("era5_download_status.csv")
-while True:
-    if all(df["status"] == "done"):
-        print("All files are downloaded.")
-        break
-    not_started = df[df["status"] == "not started"]
-    started = df[df["status"] == "started"]
-    if started.shape[0] < 19 and not_started.shape[0] > 0:
-        add_index = not_started.iloc[0].name
-        df.iloc[add_index, 2] =  submit_request(df.iloc[add_index, 0])
-        df.iloc[add_index, 1] = "started"
-    for index, row in started.iterrows():
-        r.url = BASE_URL + row["request_id"]
-        r.update()
-        if r.reply["state"] == "completed":
+    return request
 
-            df.iloc[index, 1] = "done"
-            print("Downloaded data for year: ", df.iloc[index, 0], end='\r')
-            try:
-                r.download(output_dir + str(df.iloc[index, 0]) + ".nc")
-            except:
-                print("Error downloading data for year: ", df.iloc[index, 0])
-        elif r.reply["state"] == "failed":
-            df.iloc[index, 1] = "failed"
-            print("Failed to download data for year: ", df.iloc[index, 0])
-        elif r.reply["state"] == "running":
-            print("Data for year: ", df.iloc[index, 0], "is running.", end='\r')
-        elif r.reply["state"] == "queued":
-            print("Data for year: ", df.iloc[index, 0], "is queued.", end='\r')
-        elif r.reply["state"] == "accepted":
-            print("Data for year: ", df.iloc[index, 0], "is accepted.", end='\r')
-        time.sleep(2)
-    time.sleep(SLEEP_TIME)
-    df.to_csv("era5_download_status.csv")
+if args.url is None and args.key is not None:
+    args.url = URL
+client = CdsClient(args.url, args.key)
+jobs = [Job(year, dataset, year_request(year), os.path.join(output_dir, year + ".nc"))
+        for year in years]
+# at most 19 requests are queued at a time, the others wait for a free place
+if run(jobs, client, JOURNAL, resume=args.resume):
+    sys.exit(1)
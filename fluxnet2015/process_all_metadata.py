@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Process every FLUXNET2015 BIF file of a directory or glob in one run.
+
+The files, e.g. FLX_AA-Flx_BIF_DD_20200501.xlsx, are read in parallel worker
+processes. The sites of the releases of each temporal variant (DD, HH, WW, MM,
+YY) are merged into metadata_<temporal code>_clean.csv, and the sites of all
+the variants into one table, metadata_all_clean.csv, with one row per site and
+the variants it was found in.
+
+When a site is in several files, a single value (location, UTC offset, annual
+climate, canopy heights) is taken from the newest release that has it, and
+the sensor heights and depths of all the files are kept.
+"""
+import argparse
+import glob
+import os
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from process_metadata import XLSX_EXTENSIONS, new_site, read_sites, write_sites
+
+BIF_PATTERN = "FLX_AA-Flx_BIF_*"
+BIF_EXTENSIONS = XLSX_EXTENSIONS + (".csv",)
+MERGED_NAME = "all"
+
+SINGLE_FIELDS = ["latitude", "longitude", "utc_offset", "annual_temp", "annual_precip"]
+SET_FIELDS = ["atmospheric_sensor_heights", "swc_depths", "ts_depths"]
+
+def bif_variant(path):
+    """(temporal code, release) of a BIF file name, e.g. ("DD", "20200501")."""
+    fields = os.path.splitext(os.path.basename(path))[0].split("_")
+    if len(fields) < 5:
+        raise ValueError(f"{path} is not named like FLX_AA-Flx_BIF_DD_20200501.xlsx")
+    return fields[3], fields[4]
+
+def find_bif_files(inputs):
+    """BIF files of the given files, directories and glob patterns.
+
+    A release converted to CSV next to its .xlsx file is only read once, from
+    the .xlsx file.
+    """
+    paths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, BIF_PATTERN)
+        paths += [path for path in sorted(glob.glob(pattern))
+                  if path.lower().endswith(BIF_EXTENSIONS)]
+    files = {}
+    for path in paths:
+        variant = bif_variant(path)
+        if variant not in files or files[variant].lower().endswith(".csv"):
+            files[variant] = path
+    return files
+
+def merge_sites(site_lists):
+    """Merge the sites of several files, from the oldest to the newest release."""
+    merged = defaultdict(new_site)
+    # the newest release first, so that its sites keep their order
+    for sites in reversed(site_lists):
+        for site_id, data in sites.items():
+            site = merged[site_id]
+            for field in SINGLE_FIELDS:
+                if site[field] is None:
+                    site[field] = data[field]
+            if not site["canopy_height_values"]:
+                site["canopy_height_values"] = list(data["canopy_height_values"])
+            for field in SET_FIELDS:
+                site[field] |= data[field]
+    return merged
+
+def process_all_metadata(inputs, output_dir, workers=None, index=False):
+    """Write the per-variant and merged metadata of the BIF files of inputs.
+
+    Returns the paths of the files written.
+    """
+    files = find_bif_files(inputs)
+    if not files:
+        raise FileNotFoundError(f"no BIF files found in {' '.join(inputs)}")
+    os.makedirs(output_dir, exist_ok=True)
+    variants = sorted(files, key=lambda variant: (variant[1], variant[0]))
+    with ProcessPoolExecutor(workers) as pool:
+        site_lists = dict(zip(variants, pool.map(read_sites, [files[variant] for variant in variants])))
+
+    written = []
+    codes = sorted({code for code, _ in variants})
+    # the merged table is built first, as write_sites post-processes the sites in place
+    merged = merge_sites([site_lists[variant] for variant in variants])
+    for site_id, site in merged.items():
+        site["variants"] = ";".join(code for code in codes
+                                    if any(site_id in site_lists[variant]
+                                           for variant in variants if variant[0] == code))
+    merged = dict(sorted(merged.items()))
+    merged_csv = os.path.join(output_dir, f"metadata_{MERGED_NAME}_clean.csv")
+    if index:
+        # numpy is only needed for the spatial index
+        from site_index import SiteIndex
+
+        index_path = os.path.join(output_dir, f"metadata_{MERGED_NAME}_sites.npz")
+        SiteIndex.from_sites(merged).save(index_path)
+        written.append(index_path)
+    write_sites(merged, merged_csv, extra_columns=["variants"])
+    written.append(merged_csv)
+
+    for code in codes:
+        releases = [site_lists[variant] for variant in variants if variant[0] == code]
+        sites = releases[0] if len(releases) == 1 else merge_sites(releases)
+        output_csv = os.path.join(output_dir, f"metadata_{code}_clean.csv")
+        write_sites(sites, output_csv)
+        written.append(output_csv)
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the site metadata of all the FLUXNET2015 BIF files")
+    parser.add_argument("inputs", nargs="+",
+                        help="BIF files, directories holding them or glob patterns, as .xlsx or .csv")
+    parser.add_argument("--output-dir", required=True, help="directory of the clean metadata files")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes reading the files (default: number of CPUs)")
+    parser.add_argument("--index", action="store_true",
+                        help="also save a spatial index of the merged sites (see site_index.py)")
+    args = parser.parse_args()
+    try:
+        written = process_all_metadata(args.inputs, args.output_dir, args.workers, args.index)
+    except (FileNotFoundError, ValueError) as error:
+        print(error)
+        sys.exit(1)
+    for path in written:
+        print(f"Processed metadata saved at: {path}")
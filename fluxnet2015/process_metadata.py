@@ -1,27 +1,42 @@
 #!/usr/bin/env python3
+import argparse
 import csv
-import sys
 import os
 import re
 from collections import defaultdict
 
-def process_metadata(input_csv, output_csv):
-    os.makedirs(os.path.dirname(output_csv), exist_ok=True)
+KEY_MAP = {
+    "LOCATION_LAT": "latitude",
+    "LOCATION_LONG": "longitude",
+    "UTC_OFFSET": "utc_offset",
+    "HEIGHTC": "canopy_height_raw",
+    "MAT": "annual_temp",
+    "MAP": "annual_precip",
+}
 
-    key_map = {
-        "LOCATION_LAT": "latitude",
-        "LOCATION_LONG": "longitude",
-        "UTC_OFFSET": "utc_offset",
-        "HEIGHTC": "canopy_height_raw",
-        "MAT": "annual_temp",
-        "MAP": "annual_precip",
-    }
+# Variable names whose height or depth is the value of the next row, and the
+# site field it is added to. Values are first looked up by their first three
+# characters, so that most rows are classified with one dictionary lookup and
+# at most one regex runs per row.
+CO2_VARIABLE = "CO2_F_MDS"
+SWC_PATTERN = re.compile(r"^SWC_F_MDS_\d+$")
+TS_PATTERN = re.compile(r"^TS_F_MDS_\d+$")
+HEIGHT_VARIABLES = {
+    "CO2": (lambda value: value == CO2_VARIABLE, "atmospheric_sensor_heights"),
+    "SWC": (SWC_PATTERN.match, "swc_depths"),
+    "TS_": (TS_PATTERN.match, "ts_depths"),
+}
+
+# Input files read as Excel workbooks; other files are read as CSV
+XLSX_EXTENSIONS = (".xlsx", ".xlsm")
 
-    # Regex for SWC & TS variable detection
-    swc_pattern = re.compile(r"^SWC_F_MDS_\d+$")
-    ts_pattern = re.compile(r"^TS_F_MDS_\d+$")
+OUTPUT_COLUMNS = [
+    "site_id", "latitude", "longitude", "utc_offset", "annual_temp", "annual_precip",
+    "canopy_height", "atmospheric_sensor_heights", "swc_depths", "ts_depths"
+]
 
-    sites = defaultdict(lambda: {
+def new_site():
+    return {
         "latitude": None,
         "longitude": None,
         "utc_offset": None,
@@ -31,54 +46,63 @@ def process_metadata(input_csv, output_csv):
         "atmospheric_sensor_heights": set(),
         "swc_depths": set(),
         "ts_depths": set()
-    })
+    }
+
+def with_next(rows):
+    """Yield (row, next row) for every row, with None after the last row."""
+    rows = iter(rows)
+    row = next(rows, None)
+    for next_row in rows:
+        yield row, next_row
+        row = next_row
+    if row is not None:
+        yield row, None
 
-    with open(input_csv, newline='') as f:
-        rows = list(csv.reader(f))
+def aggregate_sites(rows, sites=None):
+    """Collect the metadata of every site from the rows of a BIF table.
 
-    i = 0
-    while i < len(rows):
-        row = rows[i]
+    rows is any iterable of rows with the site in column 0, the variable in
+    column 3 and its value in column 4. They are read one at a time, looking
+    one row ahead for the heights of the CO2, SWC and TS variables. Returns a
+    dict of sites, in order of appearance, as used by write_sites.
+    """
+    sites = defaultdict(new_site) if sites is None else sites
+
+    for row, next_row in with_next(rows):
         site_id, key, value = row[0], row[3], row[4]
 
         # Handle direct key mappings
-        if key in key_map:
+        target_key = KEY_MAP.get(key)
+        if target_key is not None:
             if key == "HEIGHTC":
                 try:
                     sites[site_id]["canopy_height_values"].append(float(value))
                 except ValueError:
                     pass
             else:
-                target_key = key_map[key]
                 try:
                     sites[site_id][target_key] = float(value)
                 except ValueError:
                     sites[site_id][target_key] = value
 
-        # Atmospheric sensor heights (CO2_F_MDS -> next row)
-        if value == "CO2_F_MDS" and i + 1 < len(rows):
-            try:
-                sites[site_id]["atmospheric_sensor_heights"].add(float(rows[i + 1][4]))
-            except ValueError:
-                pass
-
-        # Soil water content depths
-        if swc_pattern.match(value) and i + 1 < len(rows):
-            try:
-                sites[site_id]["swc_depths"].add(float(rows[i + 1][4]))
-            except ValueError:
-                pass
-
-        # Soil temperature depths
-        if ts_pattern.match(value) and i + 1 < len(rows):
-            try:
-                sites[site_id]["ts_depths"].add(float(rows[i + 1][4]))
-            except ValueError:
-                pass
-
-        i += 1
-
-    # Post-process results
+        # Atmospheric sensor heights, soil water content and soil temperature
+        # depths are in the next row
+        height_variable = HEIGHT_VARIABLES.get(value[:3])
+        if height_variable is not None and next_row is not None:
+            matches, field = height_variable
+            if matches(value):
+                try:
+                    sites[site_id][field].add(float(next_row[4]))
+                except ValueError:
+                    pass
+
+    return sites
+
+def write_sites(sites, output_csv, extra_columns=()):
+    """Post-process the aggregated sites and write one row per site.
+
+    The values of extra_columns are written as they are, after OUTPUT_COLUMNS.
+    """
     for site_id, data in sites.items():
         # Canopy height average
         if data["canopy_height_values"]:
@@ -94,10 +118,7 @@ def process_metadata(input_csv, output_csv):
     # Write minimal CSV
     with open(output_csv, "w", newline='') as f:
         writer = csv.writer(f)
-        writer.writerow([
-            "site_id", "latitude", "longitude", "utc_offset", "annual_temp", "annual_precip",
-            "canopy_height", "atmospheric_sensor_heights", "swc_depths", "ts_depths"
-        ])
+        writer.writerow(OUTPUT_COLUMNS + list(extra_columns))
         for site_id, data in sites.items():
             writer.writerow([
                 site_id,
@@ -110,10 +131,50 @@ def process_metadata(input_csv, output_csv):
                 ";".join(map(str, data["atmospheric_sensor_heights"])),
                 ";".join(map(str, data["swc_depths"])),
                 ";".join(map(str, data["ts_depths"]))
-            ])
+            ] + [data[column] for column in extra_columns])
+
+def xlsx_rows(input_xlsx):
+    """Yield the first five columns of the rows of the first sheet of an .xlsx file.
+
+    The sheet is streamed in read-only mode. Cells are converted to strings,
+    with empty cells as "", like in the CSV files converted with xlsx2csv.
+    """
+    # openpyxl is only needed for .xlsx input
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(input_xlsx, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(max_col=5, values_only=True):
+            yield ["" if value is None else str(value) for value in row]
+    finally:
+        workbook.close()
+
+def read_sites(input_path):
+    """aggregate_sites of the rows of a BIF .xlsx or .csv file."""
+    if input_path.lower().endswith(XLSX_EXTENSIONS):
+        return aggregate_sites(xlsx_rows(input_path))
+    with open(input_path, newline='') as f:
+        return aggregate_sites(csv.reader(f))
+
+def process_metadata(input_path, output_csv, index_path=None):
+    """Write the metadata of every site of a BIF .xlsx or .csv file to output_csv.
+
+    If index_path is given, a SiteIndex of the sites is also saved to it.
+    """
+    os.makedirs(os.path.dirname(output_csv), exist_ok=True)
+    sites = read_sites(input_path)
+    if index_path is not None:
+        # numpy is only needed for the spatial index
+        from site_index import SiteIndex
+
+        SiteIndex.from_sites(sites).save(index_path)
+    write_sites(sites, output_csv)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: process_fluxnet_metadata.py input_csv output_csv")
-        sys.exit(1)
-    process_metadata(sys.argv[1], sys.argv[2])
+    parser = argparse.ArgumentParser(description="Extract the site metadata of a FLUXNET2015 BIF file")
+    parser.add_argument("input", help="BIF file, as .xlsx or converted to .csv")
+    parser.add_argument("output_csv")
+    parser.add_argument("--index", default=None, metavar="NPZ",
+                        help="also save a spatial index of the sites to this .npz file (see site_index.py)")
+    args = parser.parse_args()
+    process_metadata(args.input, args.output_csv, args.index)
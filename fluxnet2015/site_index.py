@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""Spatial index of the FLUXNET sites, for matching them with gridded data.
+
+The sites are stored as unit vectors in a KD-tree, so that the nearest sites
+to a point, or the sites within a distance of it, are found in O(log N) per
+query on average instead of a scan over all the sites. The tree is balanced and
+implicit: the sites are sorted so that the middle of every range of sites is
+the node splitting that range. It is saved with the sites to an .npz file:
+
+    index = SiteIndex.from_metadata_csv("metadata_DD_clean.csv")
+    index.save("metadata_DD_sites.npz")
+    index = SiteIndex.load("metadata_DD_sites.npz")
+    index.nearest(45.2, -68.7, k=3)
+    index.within(45.2, -68.7, radius_km=100)
+    index.grid_cells(era5_latitudes, era5_longitudes)
+"""
+import csv
+import heapq
+import math
+import sys
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+def unit_vectors(latitudes, longitudes):
+    """Points on the unit sphere of latitudes and longitudes in degrees, shape (N, 3)."""
+    lat = np.deg2rad(np.asarray(latitudes, dtype=np.float64))
+    lon = np.deg2rad(np.asarray(longitudes, dtype=np.float64))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+def chord_to_km(chord):
+    """Great-circle distance of a chord between two points of the unit sphere."""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+def km_to_chord(distance_km):
+    return 2 * math.sin(min(distance_km / EARTH_RADIUS_KM, math.pi) / 2)
+
+def build_tree(points):
+    """Order and split axes of the implicit KD-tree of points.
+
+    For every range [lo, hi) of order, the point order[mid], mid = (lo + hi) // 2,
+    splits the range along axis split[mid]: the points of [lo, mid) are not
+    above it along that axis, and those of [mid + 1, hi) not below.
+    """
+    n = len(points)
+    order = np.arange(n)
+    split = np.zeros(n, dtype=np.int8)
+    ranges = [(0, n)]
+    while ranges:
+        lo, hi = ranges.pop()
+        if hi - lo < 2:
+            continue
+        sites = order[lo:hi]
+        # split along the axis where the points spread the most
+        axis = int(np.argmax(np.ptp(points[sites], axis=0)))
+        mid = (lo + hi) // 2
+        order[lo:hi] = sites[np.argpartition(points[sites, axis], mid - lo)]
+        split[mid] = axis
+        ranges += [(lo, mid), (mid + 1, hi)]
+    return order, split
+
+def nearest_centers(centers, values, period=None):
+    """Index of the nearest of centers for every value, by binary search.
+
+    With a period, e.g. 360 for longitudes, the coordinates are compared
+    modulo the period. Ties go to the lowest index.
+    """
+    centers = np.asarray(centers, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(centers, kind='stable')
+    sorted_centers = centers[order]
+    n = len(centers)
+    if period is not None:
+        values = sorted_centers[0] + np.mod(values - sorted_centers[0], period)
+    position = np.searchsorted(sorted_centers, values)
+    if period is None:
+        candidates = [np.clip(position - 1, 0, n - 1), np.clip(position, 0, n - 1)]
+    else:
+        # the neighbours below and above, wrapping around the period
+        candidates = [(position - 1) % n, position % n]
+    best = None
+    for candidate in candidates:
+        distance = np.abs(sorted_centers[candidate] - values)
+        if period is not None:
+            distance = np.minimum(distance, period - distance)
+        index = order[candidate]
+        if best is None:
+            best, best_distance = index, distance
+        else:
+            closer = (distance < best_distance) | ((distance == best_distance) & (index < best))
+            best = np.where(closer, index, best)
+            best_distance = np.where(closer, distance, best_distance)
+    return best
+
+class SiteIndex:
+    """KD-tree of sites on the sphere, with nearest, radius and grid cell queries."""
+
+    def __init__(self, site_ids, latitudes, longitudes, order=None, split=None):
+        self.site_ids = list(site_ids)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        points = unit_vectors(self.latitudes, self.longitudes)
+        if order is None:
+            order, split = build_tree(points)
+        self.order = np.asarray(order)
+        self.split = np.asarray(split)
+        # the queries walk the tree in Python, on tuples of Python floats
+        self._points = [tuple(point) for point in points.tolist()]
+        self._order = self.order.tolist()
+        self._split = self.split.tolist()
+
+    @classmethod
+    def from_sites(cls, sites):
+        """Index of the sites of process_metadata.aggregate_sites with a numeric location."""
+        located = [(site_id, data["latitude"], data["longitude"]) for site_id, data in sites.items()
+                   if isinstance(data["latitude"], float) and isinstance(data["longitude"], float)]
+        return cls(*zip(*located)) if located else cls([], [], [])
+
+    @classmethod
+    def from_metadata_csv(cls, path):
+        """Index of the sites of a CSV file written by process_metadata.py."""
+        site_ids, latitudes, longitudes = [], [], []
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                try:
+                    latitude, longitude = float(row["latitude"]), float(row["longitude"])
+                except ValueError:
+                    continue
+                site_ids.append(row["site_id"])
+                latitudes.append(latitude)
+                longitudes.append(longitude)
+        return cls(site_ids, latitudes, longitudes)
+
+    def save(self, path):
+        np.savez(path, site_ids=np.array(self.site_ids, dtype=str), latitudes=self.latitudes,
+                 longitudes=self.longitudes, order=self.order, split=self.split)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["site_ids"].tolist(), data["latitudes"], data["longitudes"],
+                       data["order"], data["split"])
+
+    def __len__(self):
+        return len(self.site_ids)
+
+    def _search(self, query, visit, bound):
+        """Walk the tree, nearest side first.
+
+        visit(site, squared chord) is called for every node that is reached.
+        The far side of a node is skipped if the squared distance to the
+        splitting plane is above bound(), checked when that side is reached so
+        that a bound that shrinks during the search prunes more.
+        """
+        points, order, split = self._points, self._order, self._split
+        ranges = [(0, len(order), 0.0)]
+        while ranges:
+            lo, hi, plane = ranges.pop()
+            if lo >= hi or plane > bound():
+                continue
+            mid = (lo + hi) // 2
+            site = order[mid]
+            point = points[site]
+            visit(site, (query[0] - point[0]) ** 2 + (query[1] - point[1]) ** 2
+                  + (query[2] - point[2]) ** 2)
+            axis = split[mid]
+            difference = query[axis] - point[axis]
+            if difference < 0:
+                near, far = (lo, mid), (mid + 1, hi)
+            else:
+                near, far = (mid + 1, hi), (lo, mid)
+            # the far side is pushed first, so that the near side is searched first
+            ranges.append(far + (difference * difference,))
+            ranges.append(near + (0.0,))
+
+    def nearest(self, latitude, longitude, k=1):
+        """The k sites nearest to a point, as (site_id, distance in km), nearest first."""
+        if k <= 0:
+            return []
+        query = tuple(unit_vectors(latitude, longitude).tolist())
+        # max-heap of the k nearest sites found so far
+        heap = []
+        def visit(site, distance):
+            if len(heap) < k:
+                heapq.heappush(heap, (-distance, -site))
+            elif (-distance, -site) > heap[0]:
+                heapq.heapreplace(heap, (-distance, -site))
+        self._search(query, visit, lambda: -heap[0][0] if len(heap) == k else math.inf)
+        return [(self.site_ids[-site], chord_to_km(math.sqrt(-distance)))
+                for distance, site in sorted(heap, reverse=True)]
+
+    def within(self, latitude, longitude, radius_km):
+        """The sites at most radius_km from a point, as (site_id, distance in km), nearest first."""
+        query = tuple(unit_vectors(latitude, longitude).tolist())
+        bound = km_to_chord(radius_km) ** 2
+        found = []
+        def visit(site, distance):
+            if distance <= bound:
+                found.append((distance, site))
+        self._search(query, visit, lambda: bound)
+        return [(self.site_ids[site], chord_to_km(math.sqrt(distance))) for distance, site in sorted(found)]
+
+    def grid_cells(self, grid_latitudes, grid_longitudes):
+        """Row and column of the nearest cell of a rectilinear grid for every site.
+
+        grid_latitudes and grid_longitudes are the 1D cell centers, in any order
+        and in any longitude convention. Returns (lat_index, lon_index), in the
+        order of site_ids.
+        """
+        return (nearest_centers(grid_latitudes, self.latitudes),
+                nearest_centers(grid_longitudes, self.longitudes, period=360))
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: site_index.py metadata_clean_csv index_npz")
+        sys.exit(1)
+    SiteIndex.from_metadata_csv(sys.argv[1]).save(sys.argv[2])
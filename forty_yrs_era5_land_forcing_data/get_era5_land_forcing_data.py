@@ -1,12 +1,6 @@
-# API and command line interface
-import cdsapi
+# Command line interface
 import sys
 
-# For making multiple requests at the same time
-import concurrent.futures
-from itertools import repeat
-import copy
-
 # OS operations such as manipulating file paths and get file size
 import os.path
 import os
@@ -14,40 +8,21 @@ import shutil
 
 from unzip_era5_data import unzip_era_5_files
 
-def get_era5_forcing_data_for(YOUR_API_KEY, year, months, res):
-    """Get the ERA5 forcing data for ClimaLand for `months` from `year`."""
-    # Make file path from year and months
-    first_month = months[0]
-    filename = f"era5_forcing_data_{year}_{first_month}.zip"
-
-    dirpath = f"era_5_{year}"
-    try:
-        os.mkdir(dirpath)
-        print(f"Directory '{directory_name}' created successfully.")
-    except FileExistsError:
-        print(f"Directory '{dirpath}' already exists.")
-    except PermissionError:
-        print(f"Permission denied: Unable to create '{dirpath}'.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
-    filepath = os.path.join(dirpath, filename)
-
-    # If file exists, exit and do not make request
-    if os.path.isfile(filepath):
-        print(f"{filepath} already exists; will not request data")
-        return None
-
-    filename_inst = f"era5_forcing_data_{year}_{first_month}_inst.zip"
-    filename_rate = f"era5_forcing_data_{year}_{first_month}_rate.zip"
-    filepath_inst = os.path.join(dirpath, filename_inst)
-    filepath_rate = os.path.join(dirpath, filename_rate)
-    if os.path.isfile(filepath_inst) and os.path.isfile(filepath_rate):
-        print(f"{filepath_inst} and {filepath_rate} already exist; will not request data")
-        return None
-
-    dataset = "reanalysis-era5-single-levels"
-    request = {
+# The request planner and job orchestrator shared by the ERA5 download scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "download_tools"))
+from cds_jobs import CdsClient, Job, run
+from cds_planner import plan
+
+dataset = "reanalysis-era5-single-levels"
+MONTHS = ["01", "02", "03", "04", "05", "06", "07", "08", "09", "10", "11", "12"]
+# Largest chunk requested, in fields: one month of the 12 hourly variables (at most
+# 12 * 31 * 24 = 8928 fields), as smaller requests are prioritized in the queue
+MAX_FIELDS = 9000
+JOURNAL = "era5_forcing_data_journal.jsonl"
+
+def forcing_request(year, months, res):
+    """Request of the ERA5 forcing data for ClimaLand for `months` from `year`."""
+    return {
     "product_type": ["reanalysis"],
     "variable": [
         "10m_u_component_of_wind",
@@ -92,9 +67,31 @@ def get_era5_forcing_data_for(YOUR_API_KEY, year, months, res):
     "download_format": "unarchived",
     'grid'  : [res, res]
 }
-    client = cdsapi.Client(url="https://cds.climate.copernicus.eu/api", key=YOUR_API_KEY)
-    result = client.retrieve(dataset, request, filepath)
-    return None
+
+def forcing_job(year, months, res):
+    """Job getting the ERA5 forcing data for ClimaLand for `months` from `year`, or None if
+    it is already downloaded."""
+    # Make file path from year and months
+    first_month = months[0]
+    filename = f"era5_forcing_data_{year}_{first_month}.zip"
+    dirpath = f"era_5_{year}"
+    filepath = os.path.join(dirpath, filename)
+
+    # If file exists, do not make request
+    if os.path.isfile(filepath):
+        print(f"{filepath} already exists; will not request data")
+        return None
+
+    filename_inst = f"era5_forcing_data_{year}_{first_month}_inst.zip"
+    filename_rate = f"era5_forcing_data_{year}_{first_month}_rate.zip"
+    filepath_inst = os.path.join(dirpath, filename_inst)
+    filepath_rate = os.path.join(dirpath, filename_rate)
+    if os.path.isfile(filepath_inst) and os.path.isfile(filepath_rate):
+        print(f"{filepath_inst} and {filepath_rate} already exist; will not request data")
+        return None
+
+    os.makedirs(dirpath, exist_ok=True)
+    return Job(f"{year}_{first_month}", dataset, forcing_request(year, months, res), filepath)
 
 def find_remaining_files(path, year_begin, year_end):
     """Get a list of the files that need to be downloaded for the years from `year_begin` to `year_end` - 1."""
@@ -110,7 +107,7 @@ def find_remaining_files(path, year_begin, year_end):
     # Compute files we need to get
     files_to_get = []
     for (year, dirpath) in zip(range(int(year_begin), int(year_end)), dirpaths):
-        for month in ["01", "02", "03", "04", "05", "06", "07", "08", "09", "10", "11", "12"]:
+        for month in MONTHS:
             files_to_get.append(os.path.join(dirpath, f"era5_forcing_data_{year}_{month}.zip"))
 
     # Find the files we can remove
@@ -146,29 +143,28 @@ if __name__ == "__main__":
         sys.exit()
 
     # Split the requests over all the months and submit them all at once; otherwise, we get the
-    # error: Your request is too large, please reduce your selection.
-    months_to_split_by = [["01"], ["02"], ["03"], ["04"], ["05"], ["06"], ["07"], ["08"], ["09"], ["10"], ["11"], ["12"]]
-    months = []
-    years = []
+    # error: Your request is too large, please reduce your selection. With MAX_FIELDS, the
+    # planner splits every year into single months, which is what find_remaining_files expects.
+    # Years are strings because requests do not work with integer values for years.
+    jobs = []
     for year in range(int(year_begin), int(year_end)):
-        for i in range(len(months_to_split_by)):
-            years.append(year)
-        months += months_to_split_by
-
-    # Convert to string because request does not works with integer values for years
-    years = list(map(str, years))
-
+        for chunk in plan(dataset, forcing_request(str(year), MONTHS, res), MAX_FIELDS, axes=["month"]):
+            job = forcing_job(str(year), chunk["month"], res)
+            if job is not None:
+                jobs.append(job)
 
     # This script requests data monthly as smaller datasets are prioritized in the queue.
-    # However, a process can only have a single request at a time. To circumvent this, we
-    # spawn 144 processes and assign a request to each process. This ensures that we always have
-    # something in the queue. However, only a single request can be processed at a time which is
-    #  the main bottleneck. Furthermore, the requests will not be processed if there are too many
-    # completed requests. There is no workaround for this, as the CDS API does not support
-    # deleting requests (see this [issue](https://github.com/ecmwf/cdsapi/issues/123)). To ensure
-    # a request is always being processed, one can manually delete completed requests.
-    # "all" is for downloading all the variables in one dataset
-    with concurrent.futures.ProcessPoolExecutor(max_workers = 144) as executor:
-        executor.map(get_era5_forcing_data_for, repeat(API_KEY), years, months, repeat(res))
+    # We keep up to 144 requests in flight, so that we always have something in the queue.
+    # However, only a single request can be processed at a time which is the main bottleneck.
+    # Furthermore, the requests will not be processed if there are too many completed
+    # requests. There is no workaround for this, as the CDS API does not support deleting
+    # requests (see this [issue](https://github.com/ecmwf/cdsapi/issues/123)). To ensure a
+    # request is always being processed, one can manually delete completed requests.
+    # The requests are journaled in JOURNAL, so that a rerun polls the requests still in the
+    # queue instead of submitting them again, and failed requests and downloads are retried.
+    client = CdsClient(url="https://cds.climate.copernicus.eu/api", key=API_KEY)
+    failed = run(jobs, client, JOURNAL, max_in_flight=144)
 
     unzip_era_5_files()
+    if failed:
+        sys.exit(1)
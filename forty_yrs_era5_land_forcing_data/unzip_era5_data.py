@@ -1,33 +1,97 @@
+import argparse
 import zipfile
+import zlib
 import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
-def unzip_era_5_files():
-    # Get all directories starting eith era_5_*
-    era_5_dirs = []
-    for (_, dirs, _) in os.walk("."):
-        for directory in dirs:
-            if directory.startswith("era_5"):
-                era_5_dirs.append(directory)
-    # Get all the files in the directory in a list
+BLOCK_SIZE = 1024**2
+
+def forcing_zips():
+    """Zip files of the forcing data in the era_5_* directories."""
+    # Get all directories starting with era_5_*
+    era_5_dirs = sorted(entry.path for entry in os.scandir(".")
+                        if entry.is_dir() and entry.name.startswith("era_5"))
+    zip_files = []
     for directory in era_5_dirs:
-        # Get all files
-        only_files = [os.path.join(directory, f) for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))]
-
-        # Filter to get zip files whose names start with "era_5_focing_data_"
-        only_zips = [f for f in only_files if os.path.basename(f).startswith("era5_forcing_data") and os.path.basename(f).endswith(".zip")]
-        for zip_file in only_zips:
-            # Get the file name excluding .zip at the end
-            file_name_without_zip = zip_file[:-4]
-            zipdata = zipfile.ZipFile(zip_file)
-            zipinfos = zipdata.infolist()
-            for zipinfo in zipinfos:
-                file_name = zipinfo.filename
-                # Rename files extracted
-                if "avg" in file_name:
-                    desired_file_name = file_name_without_zip + "_rate.nc"
-                elif "instant" in file_name:
-                    desired_file_name = file_name_without_zip + "_inst.nc"
-                else:
-                    raise FileExistsError("A file exists in the zip file that is not expected!")
-                zipinfo.filename = desired_file_name
-                zipdata.extract(zipinfo)
+        # Filter to get zip files whose names start with "era5_forcing_data"
+        zip_files += sorted(entry.path for entry in os.scandir(directory)
+                            if entry.is_file() and entry.name.startswith("era5_forcing_data")
+                            and entry.name.endswith(".zip"))
+    return zip_files
+
+def extracted_name(zip_file, member_name):
+    """Name of the file extracted from the member of a zip file of forcing data."""
+    # Get the file name excluding .zip at the end
+    file_name_without_zip = zip_file[:-4]
+    # Rename files extracted
+    if "avg" in member_name:
+        return file_name_without_zip + "_rate.nc"
+    elif "instant" in member_name:
+        return file_name_without_zip + "_inst.nc"
+    raise FileExistsError("A file exists in the zip file that is not expected!")
+
+def is_extracted(zipinfo, path):
+    """Whether path has the size and CRC of the member zipinfo."""
+    if not os.path.isfile(path) or os.path.getsize(path) != zipinfo.file_size:
+        return False
+    crc = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            crc = zlib.crc32(block, crc)
+    return crc == zipinfo.CRC
+
+def unzip_era_5_file(zip_file):
+    """Extract the members of a zip file that are not extracted yet.
+
+    Every member is written under a temporary name and renamed once it is
+    complete, so that an interrupted extraction never leaves a truncated .nc
+    file. Returns the number of members (extracted, skipped).
+    """
+    extracted = skipped = 0
+    with zipfile.ZipFile(zip_file) as zipdata:
+        for zipinfo in zipdata.infolist():
+            desired_file_name = extracted_name(zip_file, zipinfo.filename)
+            if is_extracted(zipinfo, desired_file_name):
+                skipped += 1
+                continue
+            partial = desired_file_name + ".tmp"
+            # the CRC of the member is checked by zipfile as it is read
+            with zipdata.open(zipinfo) as member, open(partial, "wb") as f:
+                shutil.copyfileobj(member, f, BLOCK_SIZE)
+            os.replace(partial, desired_file_name)
+            extracted += 1
+    return extracted, skipped
+
+def unzip_era_5_files(workers=None):
+    """Extract the zip files of the forcing data in parallel, with workers processes."""
+    zip_files = forcing_zips()
+    extracted = skipped = 0
+    failed = []
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(unzip_era_5_file, zip_file) for zip_file in zip_files]
+        for zip_file, future in zip(zip_files, futures):
+            try:
+                counts = future.result()
+            except (OSError, zipfile.BadZipFile) as error:
+                print(f"Failed to extract {zip_file}: {error}")
+                failed.append(zip_file)
+                continue
+            extracted += counts[0]
+            skipped += counts[1]
+    print(f"Extracted {extracted} file(s) from {len(zip_files)} zip file(s), "
+          f"{skipped} already extracted")
+    if failed:
+        raise RuntimeError(f"Failed to extract {len(failed)} zip file(s): {', '.join(failed)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the zip files of the forcing data in the era_5_* directories")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes extracting the files (default: number of CPUs)")
+    args = parser.parse_args()
+    try:
+        unzip_era_5_files(args.workers)
+    except RuntimeError as error:
+        print(error)
+        sys.exit(1)
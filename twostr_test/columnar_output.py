@@ -0,0 +1,87 @@
+"""
+Typed columnar output of the TwoStream test cases.
+
+The cases are written to an .npz file with one float64 array per column, and a
+`columns` array with the column names in the order of the csv file. The file
+is filled block by block: every column is first written to a memory-mapped .npy
+file, and the finished .npy files are then stored, uncompressed, in the .npz
+archive. It can be read with numpy.load:
+
+    with np.load("twostr_test.npz") as data:
+        fapar = data["FAPAR"]
+"""
+
+################################################################################
+# IMPORTS                                                                      #
+################################################################################
+
+import os
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+################################################################################
+# CONSTANTS                                                                    #
+################################################################################
+
+# Size of the blocks copied from the column files to the .npz file
+COPY_BUFFER_SIZE = 1 << 24
+
+################################################################################
+# CLASSES                                                                      #
+################################################################################
+
+class ColumnWriter:
+    """Write a table of n_rows rows of float64 columns to an .npz file."""
+
+    def __init__(self, path, columns, n_rows):
+        self.path = path
+        self.columns = list(columns)
+        # the column files are kept next to the output, on the same file system
+        self.directory = tempfile.mkdtemp(
+            prefix=".columns-", dir=os.path.dirname(os.path.abspath(path)))
+        self.arrays = [open_memmap(os.path.join(self.directory, f"{name}.npy"),
+                                   mode="w+", dtype=np.float64, shape=(n_rows,))
+                       for name in self.columns]
+
+    def write(self, start, block):
+        """Write the rows of the 2D block, with one column per name, from row start."""
+        block = np.asarray(block, dtype=np.float64)
+        for array, values in zip(self.arrays, block.T):
+            array[start:start + len(values)] = values
+
+    def close(self):
+        """Store the columns in the .npz file, replacing it at once."""
+        names_path = os.path.join(self.directory, "columns.npy")
+        np.save(names_path, np.array(self.columns))
+        for array in self.arrays:
+            array.flush()
+        self.arrays = []
+        temporary_path = os.path.join(self.directory, "table.npz")
+        with zipfile.ZipFile(temporary_path, "w", zipfile.ZIP_STORED,
+                             allowZip64=True) as archive:
+            for name in ["columns"] + self.columns:
+                # entries without a modification time, as with numpy.savez, so
+                # that the same table gives the same file
+                with open(os.path.join(self.directory, f"{name}.npy"), "rb") as f, \
+                        archive.open(f"{name}.npy", "w", force_zip64=True) as entry:
+                    shutil.copyfileobj(f, entry, COPY_BUFFER_SIZE)
+        os.replace(temporary_path, self.path)
+        shutil.rmtree(self.directory)
+
+    def abort(self):
+        """Remove the column files without writing the .npz file."""
+        self.arrays = []
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
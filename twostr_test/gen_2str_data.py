@@ -22,14 +22,25 @@ radiation (fAPAR).
 # IMPORTS                                                                      #
 ################################################################################
 
+import argparse
 import csv
+import io
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import repeat
+import numpy as np
 from numpy import arange
 
 # Append the path to the sellersTwoStream package to python path
 sys.path.append("./py3SellersTwoStream")
 
 from sellersTwoStream import twoStream
+from columnar_output import ColumnWriter
+from two_stream_batch import (INPUT_COLUMNS, KERNEL_CACHE_SIZE, KernelCache,
+                              batch_absorption, batch_fapar, cache_report,
+                              set_kernel)
 
 ################################################################################
 # CONSTANTS                                                                    #
@@ -46,68 +57,255 @@ layer_range = (1, 5)
 LAI_range   = (3, 6)
 
 # columns to create in csv
-columns = ["mu", "LAI", "ld", "rho", "tau", "a_soil", "n_layers",
-           "prop_diffuse", "FAPAR"]
+columns = INPUT_COLUMNS + ["FAPAR"]
+
+# Number of test cases evaluated by one task of the process pool
+SHARD_CASES = 1000
+
+# Largest difference allowed between the batched and the scalar fAPAR, and
+# between their fluxes absorbed in every layer
+CHECK_TOLERANCE = 1e-12
+
+# Number of random cases compared with the scalar model before a --batch run
+DEFAULT_CHECK = 100
+
+################################################################################
+# FUNCTIONS                                                                    #
+################################################################################
+
+def reference_absorption(T, mu, LAI, ld, rho, tau, alb, n, prop, cache=None):
+    """Flux absorbed in every layer of one test case (IabPAR), computed by the
+    twoStream object T.
+
+    The kernel coefficients are taken from the KernelCache cache if given.
+    """
+    T.propDif = prop
+    T.lai = LAI
+    T.soil_r = alb
+    T.nLayers = n
+    set_kernel(T, mu, ld, rho, tau, cache)
+    IupPAR, IdnPAR, IabPAR, Iab_dLaiPAR = T.getFluxes()
+    return IabPAR
+
+def reference_fapar(T, mu, LAI, ld, rho, tau, alb, n, prop, cache=None):
+    """fAPAR of one test case, computed by the twoStream object T."""
+    return sum(reference_absorption(T, mu, LAI, ld, rho, tau, alb, n, prop,
+                                    cache))
+
+def parameter_grid():
+    """Input columns of all the test cases, in the order of the nested loops."""
+    n, prop, alb, tau, rho, ld, mu, LAI = np.meshgrid(
+        np.arange(layer_range[0], layer_range[1]),
+        arange(diff_range[0], diff_range[1], 0.2),
+        arange(alb_range[0], alb_range[1], 0.1),
+        arange(tau_range[0], tau_range[1], 0.1),
+        arange(rho_range[0], rho_range[1], 0.1),
+        arange(ld_range[0], ld_range[1], 0.1),
+        arange(mu_range[0], mu_range[1], 0.2),
+        arange(LAI_range[0], LAI_range[1], 1),
+        indexing="ij")
+    return {"mu": mu.ravel(), "LAI": LAI.ravel(), "ld": ld.ravel(),
+            "rho": rho.ravel(), "tau": tau.ravel(), "a_soil": alb.ravel(),
+            "n_layers": n.ravel(), "prop_diffuse": prop.ravel()}
+
+def latin_hypercube_cases(n_samples, seed=0):
+    """Input columns of n_samples cases from a Latin hypercube over the ranges.
+
+    Every range is split into n_samples strata of equal width, and every
+    stratum of every parameter holds exactly one case. The number of layers is
+    drawn the same way and rounded down to an integer of layer_range.
+    """
+    rng = np.random.default_rng(seed)
+    ranges = {"mu": mu_range, "LAI": LAI_range, "ld": ld_range,
+              "rho": rho_range, "tau": tau_range, "a_soil": alb_range,
+              "n_layers": layer_range, "prop_diffuse": diff_range}
+    grid = {}
+    for name in INPUT_COLUMNS:
+        low, high = ranges[name]
+        u = (rng.permutation(n_samples) + rng.random(n_samples)) / n_samples
+        grid[name] = low + u * (high - low)
+    grid["n_layers"] = np.floor(grid["n_layers"]).astype(int)
+    return grid
+
+def shards(n_cases, size=SHARD_CASES):
+    """Split range(n_cases) into consecutive slices of size cases.
+
+    The shards only depend on the number of cases, so the output does not
+    depend on the number of workers.
+    """
+    return [slice(start, min(start + size, n_cases))
+            for start in range(0, n_cases, size)]
+
+def evaluate_rows(T, grid, shard, batch=False, cache=None):
+    """csv rows of the cases of shard, with their fAPAR from the model T."""
+    inputs = [grid[name][shard] for name in INPUT_COLUMNS]
+    if batch:
+        fapar = batch_fapar(T, *inputs, cache=cache)
+    else:
+        fapar = [reference_fapar(T, mu, LAI, ld, rho, tau, alb, int(n), prop,
+                                 cache)
+                 for mu, LAI, ld, rho, tau, alb, n, prop in zip(*inputs)]
+    return [list(case) + [FAPAR] for case, FAPAR in zip(zip(*inputs), fapar)]
+
+def format_rows(rows):
+    """Text of rows as written by csv.writer."""
+    text = io.StringIO()
+    csv.writer(text).writerows(rows)
+    return text.getvalue()
+
+def evaluate_shard(T, cache, grid, shard, batch=False, binary=False):
+    """csv text of the cases of shard, their float64 table if binary, and the
+    [hits, misses] counts of the KernelCache cache for the shard."""
+    before = cache.snapshot()
+    rows = evaluate_rows(T, grid, shard, batch, cache)
+    counts = {name: [now - then for now, then in zip(count, before[name])]
+              for name, count in cache.counts.items()}
+    table = np.array(rows, dtype=np.float64) if binary else None
+    return format_rows(rows), table, counts
+
+# State of a worker process, set by _init_worker
+_worker = {}
+
+def _init_worker(grid, cache_size):
+    # every worker has its own model, as the scalar model is mutated per case
+    _worker["T"] = twoStream()
+    _worker["cache"] = KernelCache(cache_size)
+    _worker["grid"] = grid
+
+def _evaluate_shard(shard, batch, binary):
+    return evaluate_shard(_worker["T"], _worker["cache"], _worker["grid"], shard,
+                          batch, binary)
+
+def check_cases(grid, n_check, seed=0):
+    """Indices of n_check random cases of grid, spread evenly over the numbers
+    of layers so that every one of them is checked."""
+    rng = np.random.default_rng(seed)
+    n_layers = np.asarray(grid["n_layers"])
+    groups = [np.flatnonzero(n_layers == n) for n in np.unique(n_layers)]
+    cases = []
+    for i, group in enumerate(groups):
+        size = n_check // len(groups) + (i < n_check % len(groups))
+        cases.append(rng.choice(group, size=min(max(size, 1), len(group)),
+                                replace=False))
+    return np.sort(np.concatenate(cases))
+
+def check_batch(T, grid, n_check, seed=0):
+    """Compare the batched fAPAR and layer absorption of n_check random cases
+    with the scalar model.
+
+    Exits with an error if they differ by more than CHECK_TOLERANCE, or if the
+    scalar model returns another number of layers.
+    """
+    cases = check_cases(grid, n_check, seed)
+    inputs = [grid[name][cases] for name in INPUT_COLUMNS]
+    absorption = batch_absorption(T, *inputs)
+    fapar_error = layer_error = 0.0
+    for case, layers in zip(zip(*inputs), absorption):
+        reference = np.asarray(reference_absorption(T, *case[:6], int(case[6]),
+                                                    case[7]), dtype=np.float64)
+        if reference.shape != layers.shape:
+            print(f"The scalar model returns {reference.size} layers instead of "
+                  f"{layers.size} for the case "
+                  f"{dict(zip(INPUT_COLUMNS, map(float, case)))}")
+            sys.exit(1)
+        fapar_error = max(fapar_error, abs(reference.sum() - layers.sum()))
+        layer_error = max(layer_error, np.max(np.abs(reference - layers)))
+    print(f"Largest difference with the scalar model on {len(cases)} cases "
+          f"({len(np.unique(grid['n_layers'][cases]))} numbers of layers): "
+          f"{fapar_error:.3g} in fAPAR, {layer_error:.3g} in a layer")
+    if max(fapar_error, layer_error) > CHECK_TOLERANCE:
+        sys.exit(1)
+
+def shard_results(grid, workers=1, batch=False, binary=False,
+                  cache_size=KERNEL_CACHE_SIZE):
+    """Yield evaluate_shard of every shard of grid, in order.
+
+    With more than one worker, the shards are evaluated in a process pool.
+    Every process has a KernelCache of cache_size keys.
+    """
+    n_cases = len(grid["mu"])
+    if workers == 1:
+        T = twoStream()
+        cache = KernelCache(cache_size)
+        for shard in shards(n_cases):
+            yield evaluate_shard(T, cache, grid, shard, batch, binary)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(grid, cache_size)) as pool:
+        yield from pool.map(_evaluate_shard, shards(n_cases), repeat(batch),
+                            repeat(binary))
+
+def write_cases(data_file, grid, workers=1, batch=False, npz_file=None,
+                cache_size=KERNEL_CACHE_SIZE):
+    """Evaluate the test cases of grid and write them to data_file.
+
+    The shards are written in their order, so the file is the same for any
+    number of workers. If npz_file is given, the cases are also written to it
+    as float64 columns. Returns the [hits, misses] counts of the kernel
+    coefficient caches of all the processes.
+    """
+    totals = {}
+    n_cases = len(grid["mu"])
+    binary = npz_file is not None
+    with open(data_file, 'w', newline='') as out, \
+            (ColumnWriter(npz_file, columns, n_cases) if binary
+             else nullcontext()) as table:
+        csv.writer(out).writerow(columns)
+        results = shard_results(grid, workers, batch, binary, cache_size)
+        for shard, (text, block, counts) in zip(shards(n_cases), results):
+            out.write(text)
+            if binary:
+                table.write(shard.start, block)
+            for name, count in counts.items():
+                totals[name] = [a + b for a, b in zip(totals.get(name, [0, 0]),
+                                                      count)]
+    return totals
 
 ################################################################################
 # MAIN                                                                         #
 ################################################################################
 
 if __name__ == "__main__":
-    # Ensure the output file location was passed to the script
-    if len(sys.argv) != 2:
-        print("Usage: python gen_2str_data.py <output_file>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Generate the TwoStream test cases")
+    parser.add_argument("output_file")
+    parser.add_argument("--batch", action="store_true",
+                        help="evaluate the cases in arrays with NumPy")
+    parser.add_argument("--check", type=int, default=DEFAULT_CHECK, metavar="N",
+                        help="with --batch, first compare N random cases with "
+                             f"the scalar model (default {DEFAULT_CHECK}; 0 "
+                             "skips the comparison)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes evaluating the cases")
+    parser.add_argument("--samples", type=int, default=None, metavar="N",
+                        help="evaluate N cases from a Latin hypercube over the "
+                             "parameter ranges instead of the regular grid")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the Latin hypercube and of --check")
+    parser.add_argument("--kernel-cache-size", type=int,
+                        default=KERNEL_CACHE_SIZE, metavar="N",
+                        help="number of kernel coefficients kept per cache "
+                             "and process; 0 disables the caches")
+    parser.add_argument("--npz", action="store_true",
+                        help="also write the cases as float64 columns to an "
+                             ".npz file next to the output file")
+    args = parser.parse_args()
 
     # Read the output file name from the command line
-    DATA_FILE = sys.argv[1]
+    DATA_FILE = args.output_file
 
-    # Create a TwoStream model
-    T = twoStream()
+    if args.samples is None:
+        grid = parameter_grid()
+    else:
+        grid = latin_hypercube_cases(args.samples, args.seed)
+    if args.batch and args.check:
+        check_batch(twoStream(), grid, args.check, args.seed)
+    elif args.batch:
+        print("Warning: the batched fAPAR is not compared with the scalar model "
+              "(--check 0)")
+    npz_file = os.path.splitext(DATA_FILE)[0] + ".npz" if args.npz else None
     # For every combination of input parameters, calculate the fAPAR and write
     # the input parameters and output fAPAR to csv file
-    with open(DATA_FILE, 'w') as out:
-        writer = csv.DictWriter(out, fieldnames=columns)
-        writer.writeheader()
-        for n in range(layer_range[0], layer_range[1]):
-            for prop in arange(diff_range[0], diff_range[1], 0.2):
-                for alb in arange(alb_range[0], alb_range[1], 0.1):
-                    for tau in arange(tau_range[0], tau_range[1], 0.1):
-                        for rho in arange(rho_range[0], rho_range[1], 0.1):
-                            for ld in arange(ld_range[0], ld_range[1], 0.1):
-                                for mu in arange(mu_range[0], mu_range[1], 0.2):
-                                    for LAI in arange(LAI_range[0],
-                                                      LAI_range[1], 1):
-                                        T.mu = mu
-                                        T.propDif = prop
-                                        T.lai = LAI
-                                        T.leaf_r = rho
-                                        T.leaf_t = tau
-                                        T.soil_r = alb
-                                        T.nLayers = n
-                                        T.G = lambda _ : ld
-                                        T.Z = lambda _ : 1
-                                        K = T.K_generic()
-                                        T.K = lambda: K
-                                        MB = T.muBar_generic()
-                                        T.muBar = lambda: MB
-                                        B_dir = \
-                                              T.B_direct_Dickinson_generic_ssa()
-                                        T.B_direct = lambda: B_dir
-                                        B_diff = T.B_diffuse_generic()
-                                        T.B_diffuse = lambda: B_diff
-                                        IupPAR, IdnPAR, IabPAR, Iab_dLaiPAR = \
-                                                                   T.getFluxes()
-                                        FAPAR = sum(IabPAR)
-                                        row = {
-                                            "mu":mu,
-                                            "LAI":LAI,
-                                            "ld":ld,
-                                            "rho":rho,
-                                            "tau":tau,
-                                            "a_soil":alb,
-                                            "n_layers":n,
-                                            "prop_diffuse":prop,
-                                            "FAPAR": FAPAR
-                                        }
-                                        writer.writerow(row)
+    counts = write_cases(DATA_FILE, grid, args.workers, args.batch, npz_file,
+                         args.kernel_cache_size)
+    print("\n".join(cache_report(counts)))
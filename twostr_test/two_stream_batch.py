@@ -0,0 +1,240 @@
+"""
+Batched evaluation of the TwoStream test cases with NumPy.
+
+gen_2str_data.py evaluates every test case with one PySellersTwoStream
+`twoStream` object. This module computes the fAPAR of a whole array of cases at
+once. The kernel coefficients K, muBar, B_direct and B_diffuse are computed by
+the `twoStream` methods, once for every distinct (mu, ld, rho, tau). The Sellers
+(1985) two-stream equations are then solved for all the cases with array
+operations, one group of cases per number of layers.
+
+For a canopy of leaf area index L, with the cumulative leaf area l counted from
+the top, the diffuse fluxes solve
+
+    -muBar dI_up/dl + b I_up - c I_dn = d exp(-K l)
+     muBar dI_dn/dl + b I_dn - c I_up = f exp(-K l)
+
+with omega = rho + tau, b = 1 - (1 - B_diffuse) omega, c = omega B_diffuse,
+d = omega muBar K B_direct and f = omega muBar K (1 - B_direct), per unit
+incident direct flux. The boundary conditions are I_dn(0) = prop_diffuse and
+I_up(L) = a_soil (I_dn(L) + (1 - prop_diffuse) exp(-K L)). The flux absorbed by
+each of the n_layers layers of equal leaf area is the drop of the net downward
+flux across it, and the fAPAR is their sum. As the fluxes are exact at the
+layer boundaries, the fAPAR itself does not depend on n_layers; the absorption
+of every layer does, and is compared with the IabPAR of the scalar model by
+gen_2str_data.py --check.
+"""
+
+################################################################################
+# IMPORTS                                                                      #
+################################################################################
+
+from collections import OrderedDict
+
+import numpy as np
+
+################################################################################
+# CONSTANTS                                                                    #
+################################################################################
+
+# Columns of a test case, in the order of the csv file
+INPUT_COLUMNS = ["mu", "LAI", "ld", "rho", "tau", "a_soil", "n_layers",
+                 "prop_diffuse"]
+
+# Kernel coefficients cached by KernelCache, and the size of each cache
+OPTICAL_DEPTH = "K, muBar"
+SCATTERING = "B_direct, B_diffuse"
+KERNEL_CACHE_SIZE = 4096
+
+################################################################################
+# CLASSES                                                                      #
+################################################################################
+
+class KernelCache:
+    """Bounded caches of the kernel coefficients, with hit counters.
+
+    K and muBar only depend on (mu, ld), and B_direct and B_diffuse on
+    (mu, ld, rho, tau). Each cache keeps the size most recently used keys;
+    with a size of 0 nothing is kept, but the calls are still counted.
+    """
+
+    def __init__(self, size=KERNEL_CACHE_SIZE):
+        self.size = size
+        self.caches = {OPTICAL_DEPTH: OrderedDict(), SCATTERING: OrderedDict()}
+        self.counts = {name: [0, 0] for name in self.caches}
+
+    def get(self, name, key, compute):
+        """Value of key in the cache name, from compute() if it is not cached."""
+        cache = self.caches[name]
+        if key in cache:
+            cache.move_to_end(key)
+            self.counts[name][0] += 1
+            return cache[key]
+        self.counts[name][1] += 1
+        value = compute()
+        if self.size > 0:
+            cache[key] = value
+            if len(cache) > self.size:
+                cache.popitem(last=False)
+        return value
+
+    def snapshot(self):
+        """Copy of the [hits, misses] counts of each cache."""
+        return {name: list(count) for name, count in self.counts.items()}
+
+def cache_report(counts):
+    """Lines reporting the hit rate of the [hits, misses] counts of each cache."""
+    lines = []
+    for name, (hits, misses) in counts.items():
+        calls = hits + misses
+        rate = 100 * hits / calls if calls else 0
+        lines.append(f"{name}: {hits} of {calls} lookups cached "
+                     f"({rate:.1f}% hit rate, {misses} computed)")
+    return lines
+
+################################################################################
+# FUNCTIONS                                                                    #
+################################################################################
+
+def _optical_depth(T):
+    K = T.K_generic()
+    T.K = lambda: K
+    MB = T.muBar_generic()
+    return K, MB
+
+def _scattering(T):
+    B_dir = T.B_direct_Dickinson_generic_ssa()
+    T.B_direct = lambda: B_dir
+    B_diff = T.B_diffuse_generic()
+    return B_dir, B_diff
+
+def set_kernel(T, mu, ld, rho, tau, cache=None):
+    """Set the kernel coefficients of the twoStream object T for one case.
+
+    Returns (K, muBar, B_direct, B_diffuse), computed the same way as by the
+    scalar loop of gen_2str_data.py, or taken from the KernelCache cache.
+    """
+    T.mu = mu
+    T.leaf_r = rho
+    T.leaf_t = tau
+    T.G = lambda _ : ld
+    T.Z = lambda _ : 1
+    if cache is None:
+        K, MB = _optical_depth(T)
+    else:
+        K, MB = cache.get(OPTICAL_DEPTH, (mu, ld), lambda: _optical_depth(T))
+    T.K = lambda: K
+    T.muBar = lambda: MB
+    if cache is None:
+        B_dir, B_diff = _scattering(T)
+    else:
+        B_dir, B_diff = cache.get(SCATTERING, (mu, ld, rho, tau),
+                                  lambda: _scattering(T))
+    T.B_direct = lambda: B_dir
+    T.B_diffuse = lambda: B_diff
+    return K, MB, B_dir, B_diff
+
+def kernel_coefficients(T, mu, ld, rho, tau, cache=None):
+    """K, muBar, B_direct and B_diffuse for arrays of cases.
+
+    set_kernel is only called once for every distinct (mu, ld, rho, tau).
+    """
+    keys = np.stack(np.broadcast_arrays(mu, ld, rho, tau), axis=-1).reshape(-1, 4)
+    unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    coefficients = np.array([set_kernel(T, *key, cache=cache) for key in unique_keys])
+    shape = np.broadcast_shapes(np.shape(mu), np.shape(ld), np.shape(rho), np.shape(tau))
+    return tuple(column[inverse.ravel()].reshape(shape) for column in coefficients.T)
+
+def sellers_absorption(K, mu_bar, B_direct, B_diffuse, omega, LAI, a_soil,
+                       prop_diffuse, n_layers):
+    """Flux absorbed in every layer, from the top, of arrays of cases sharing
+    the integer number of layers n_layers, as an (..., n_layers) array."""
+    b = 1 - (1 - B_diffuse) * omega
+    c = omega * B_diffuse
+    d = omega * mu_bar * K * B_direct
+    f = omega * mu_bar * K * (1 - B_direct)
+    h = np.sqrt(b**2 - c**2) / mu_bar
+    sigma = (mu_bar * K)**2 + c**2 - b**2
+    # Particular solution of the direct beam, proportional to exp(-K l)
+    up_direct = -((b - mu_bar * K) * d + c * f) / sigma
+    down_direct = -((b + mu_bar * K) * f + c * d) / sigma
+    # Homogeneous solutions, decaying from the top (m) and from the bottom (p)
+    # of the canopy, so that no exponential overflows
+    up_m, down_m = c, b + mu_bar * h
+    up_p, down_p = b + mu_bar * h, c
+    direct = 1 - prop_diffuse
+    decay = np.exp(-h * LAI)
+    direct_bottom = direct * np.exp(-K * LAI)
+    # Coefficients of the homogeneous solutions from the boundary conditions
+    a11 = down_m
+    a12 = down_p * decay
+    a21 = decay * (up_m - a_soil * down_m)
+    a22 = up_p - a_soil * down_p
+    r1 = prop_diffuse - down_direct * direct
+    r2 = direct_bottom * (a_soil - up_direct + a_soil * down_direct)
+    det = a11 * a22 - a12 * a21
+    A = (r1 * a22 - a12 * r2) / det
+    B = (a11 * r2 - a21 * r1) / det
+
+    def net_flux(l):
+        """Net downward flux, direct and diffuse, at cumulative leaf area l."""
+        beam = direct * np.exp(-K * l)
+        top = np.exp(-h * l)
+        bottom = np.exp(-h * (LAI - l))
+        I_up = up_direct * beam + A * up_m * top + B * up_p * bottom
+        I_dn = down_direct * beam + A * down_m * top + B * down_p * bottom
+        return I_dn + beam - I_up
+
+    boundaries = np.stack([net_flux(LAI * i / n_layers)
+                           for i in range(n_layers + 1)], axis=-1)
+    return boundaries[..., :-1] - boundaries[..., 1:]
+
+def sellers_fapar(K, mu_bar, B_direct, B_diffuse, omega, LAI, a_soil,
+                  prop_diffuse, n_layers):
+    """fAPAR of arrays of cases sharing the integer number of layers n_layers."""
+    return sellers_absorption(K, mu_bar, B_direct, B_diffuse, omega, LAI,
+                              a_soil, prop_diffuse, n_layers).sum(axis=-1)
+
+def batch_absorption(T, mu, LAI, ld, rho, tau, a_soil, n_layers,
+                     prop_diffuse, cache=None):
+    """Flux absorbed in every layer of every case of the 1D input arrays.
+
+    Returns a list with one array of n_layers values per case. T is a
+    twoStream object used for the kernel coefficients only.
+    """
+    arrays = np.broadcast_arrays(*(np.asarray(x, dtype=np.float64) for x in
+                                   (mu, LAI, ld, rho, tau, a_soil, prop_diffuse)))
+    mu, LAI, ld, rho, tau, a_soil, prop_diffuse = (x.ravel() for x in arrays)
+    n_layers = np.broadcast_to(np.asarray(n_layers), arrays[0].shape).ravel()
+    K, mu_bar, B_direct, B_diffuse = kernel_coefficients(T, mu, ld, rho, tau, cache)
+    absorption = [None] * len(mu)
+    for n in np.unique(n_layers):
+        group = np.flatnonzero(n_layers == n)
+        layers = sellers_absorption(K[group], mu_bar[group], B_direct[group],
+                                    B_diffuse[group], rho[group] + tau[group],
+                                    LAI[group], a_soil[group],
+                                    prop_diffuse[group], int(n))
+        for case, case_layers in zip(group, layers):
+            absorption[case] = case_layers
+    return absorption
+
+def batch_fapar(T, mu, LAI, ld, rho, tau, a_soil, n_layers, prop_diffuse,
+                cache=None):
+    """fAPAR of every case of the 1D input arrays.
+
+    T is a twoStream object used for the kernel coefficients only, which are
+    taken from the KernelCache cache if given.
+    """
+    arrays = np.broadcast_arrays(*(np.asarray(x, dtype=np.float64) for x in
+                                   (mu, LAI, ld, rho, tau, a_soil, prop_diffuse)))
+    mu, LAI, ld, rho, tau, a_soil, prop_diffuse = (x.ravel() for x in arrays)
+    n_layers = np.broadcast_to(np.asarray(n_layers), arrays[0].shape).ravel()
+    K, mu_bar, B_direct, B_diffuse = kernel_coefficients(T, mu, ld, rho, tau, cache)
+    fapar = np.empty(len(mu))
+    for n in np.unique(n_layers):
+        group = n_layers == n
+        fapar[group] = sellers_fapar(K[group], mu_bar[group], B_direct[group],
+                                     B_diffuse[group], rho[group] + tau[group],
+                                     LAI[group], a_soil[group],
+                                     prop_diffuse[group], int(n))
+    return fapar.reshape(arrays[0].shape)
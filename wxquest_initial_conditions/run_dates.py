@@ -2,9 +2,15 @@
 """
 Batch wrapper for get_initial_conditions.py that accepts an explicit list of dates.
 
-Clones the private repo git@github.com:CliMA/WeatherQuest.git into a temporary
-directory and runs processing/get_initial_conditions.py from there for each
-requested date.
+Checks out the private repo git@github.com:CliMA/WeatherQuest.git and runs
+processing/get_initial_conditions.py from there for each requested date.
+
+The repo is kept in a cache directory (default: ~/.cache/run_dates), as a bare
+mirror plus one worktree per commit. A run only fetches when the head of the
+branch has moved, and works offline from the mirror if the remote cannot be
+reached. Concurrent runs take a file lock while updating the cache and share
+the worktree of the same commit. --no-cache clones into a temporary directory
+instead.
 
 Usage:
     python run_dates.py --dates 2024-01-01 2024-03-15 2024-06-01 [options]
@@ -13,20 +19,61 @@ Usage:
 Dates may optionally include a time: "YYYY-MM-DD HH:MM" (default time: 00:00).
 Any extra arguments are passed directly to get_initial_conditions.py.
 
+With --jobs N, up to N dates are processed at the same time. The output of each
+date then goes to its own log file, e.g. logs/2024-01-01_0000.log, and a line
+is printed as each date completes.
+
+With --in-process, get_initial_conditions.py is imported once per worker
+process and its main() is called for each date, so the interpreter start-up,
+the imports and any state the module keeps (CDS clients, loaded grids) are
+shared between the dates. A date that fails in-process is retried in its own
+subprocess, as without --in-process.
+
+Every run is recorded in a manifest, run_dates_manifest.json in the output
+directory (the --output-dir passed to get_initial_conditions.py), with its
+status, duration and the checksums of its output files. On a rerun with the
+same date, time and extra arguments, a date that completed and whose output
+files are unchanged is skipped. --force runs every date again.
+
 Examples:
     python run_dates.py --dates "2024-01-01 06:00" "2024-07-01 12:00"
     python run_dates.py --dates-file my_dates.txt --groups atmos,surface,land --output-dir /data/era5
     python run_dates.py --dates 2024-01-01 2024-06-01 --no-keep-separate --overwrite
+    python run_dates.py --dates-file dates.txt --jobs 4 --log-dir logs
+    python run_dates.py --dates-file dates.txt --jobs 4 --in-process
+    python run_dates.py --dates-file dates.txt --output-dir /data/era5 --force
 """
 
 import argparse
+import fcntl
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time as clock
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, redirect_stderr, redirect_stdout
 from pathlib import Path
 
 WEATHERQUEST_REPO = "git@github.com:CliMA/WeatherQuest.git"
 SCRIPT_REL_PATH = "processing/get_initial_conditions.py"
+DEFAULT_LOG_DIR = "logs"
+# Function of get_initial_conditions.py called for each date with --in-process
+ENTRY_POINT = "main"
+MANIFEST_NAME = "run_dates_manifest.json"
+DEFAULT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "run_dates"
+# Seconds to wait for the remote head of the branch before working offline
+LS_REMOTE_TIMEOUT = 60
+# Output files of get_initial_conditions.py for one date, e.g. era5_raw_20240101_0000.nc;
+# the *_processed_* files of the same date are written later by preprocessing.jl
+OUTPUT_PATTERN = "era5_*_{stamp}.nc"
+PREPROCESSED_MARKER = "_processed_"
 
 
 def parse_args():
@@ -62,8 +109,68 @@ def parse_args():
         help="Path to an existing WeatherQuest clone. If provided, skips cloning.",
     )
 
+    parser.add_argument(
+        "--repo-url",
+        default=WEATHERQUEST_REPO,
+        help=f"URL of the WeatherQuest repo (default: {WEATHERQUEST_REPO})",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        default=DEFAULT_CACHE_DIR,
+        help=f"Directory of the cached mirror and worktrees of the repo (default: {DEFAULT_CACHE_DIR})",
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Clone the repo into a temporary directory removed at exit, instead of using the cache",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Number of dates processed at the same time (default: 1)",
+    )
+
+    parser.add_argument(
+        "--log-dir",
+        metavar="DIR",
+        help="Directory of the per-date log files. Defaults to "
+             f"'{DEFAULT_LOG_DIR}' with --jobs > 1; with --jobs 1 the output "
+             "is only written to the terminal unless this is given.",
+    )
+
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help=f"Import get_initial_conditions.py once per worker and call its "
+             f"{ENTRY_POINT}() for each date, instead of starting a new Python "
+             "process per date. Failed dates are retried in a subprocess.",
+    )
+
+    parser.add_argument(
+        "--manifest",
+        metavar="FILE",
+        help=f"Manifest of the completed dates (default: {MANIFEST_NAME} in the "
+             "--output-dir passed to get_initial_conditions.py)",
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Run every date, even those the manifest records as completed",
+    )
+
     args, extra_args = parser.parse_known_args()
     args.extra_args = extra_args
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.log_dir is None and args.jobs > 1:
+        args.log_dir = DEFAULT_LOG_DIR
     return args
 
 
@@ -85,10 +192,170 @@ def load_dates_from_file(path):
     return entries
 
 
-def clone_repo(dest, branch):
-    print(f"Cloning {WEATHERQUEST_REPO} (branch: {branch}) into {dest} ...")
+def log_path(log_dir, date, time):
+    """Log file of one date, e.g. logs/2024-01-01_0000.log."""
+    return Path(log_dir) / f"{date}_{time.replace(':', '')}.log"
+
+
+def date_args(date, time, extra_args):
+    """Command line arguments of get_initial_conditions.py for one date."""
+    return ["--date", date, "--time", time] + extra_args
+
+
+def run_date(script, date, time, extra_args, log_file=None, append=False):
+    """Run get_initial_conditions.py for one date and return its exit code.
+
+    The output goes to log_file if given, and to the terminal otherwise.
+    """
+    cmd = ["python", str(script)] + date_args(date, time, extra_args)
+    if log_file is None:
+        return subprocess.run(cmd).returncode
+    with open(log_file, "a" if append else "w") as log:
+        log.write(f"$ {' '.join(cmd)}\n")
+        log.flush()
+        return subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT).returncode
+
+
+def output_dir_of(extra_args):
+    """The --output-dir passed to get_initial_conditions.py, or the current directory."""
+    for i, arg in enumerate(extra_args):
+        if arg == "--output-dir" and i + 1 < len(extra_args):
+            return Path(extra_args[i + 1])
+        if arg.startswith("--output-dir="):
+            return Path(arg.split("=", 1)[1])
+    return Path(".")
+
+
+def output_pattern(date, time):
+    """Glob pattern of the output files of one date, e.g. era5_*_20240101_0000.nc."""
+    return OUTPUT_PATTERN.format(stamp=f"{date.replace('-', '')}_{time.replace(':', '')}")
+
+
+def date_outputs(output_dir, date, time):
+    """Output files of get_initial_conditions.py for one date, e.g. era5_raw_20240101_0000.nc."""
+    return sorted(path for path in Path(output_dir).glob(output_pattern(date, time))
+                  if PREPROCESSED_MARKER not in path.name)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Record of the runs of each (date, time, extra arguments), in a JSON file.
+
+    Every entry has the status of the last run ("completed" or "failed"), its
+    exit code, duration and end time, and the size and SHA-256 checksum of the
+    output files of a completed run. The file is rewritten after every run, so
+    an interrupted batch keeps the dates it completed. A completed run with no
+    output files found is skipped on its exit code alone, with a warning.
+    """
+
+    def __init__(self, path, output_dir):
+        self.path = Path(path)
+        self.output_dir = Path(output_dir)
+        self.lock = threading.Lock()
+        self.entries = {}
+        if self.path.exists():
+            self.entries = json.loads(self.path.read_text())["runs"]
+
+    @staticmethod
+    def key(date, time, extra_args):
+        return " ".join([date, time] + extra_args)
+
+    def is_completed(self, date, time, extra_args):
+        """Whether the run completed and its output files are unchanged."""
+        entry = self.entries.get(self.key(date, time, extra_args))
+        if entry is None or entry["status"] != "completed":
+            return False
+        for name, output in entry["outputs"].items():
+            path = self.output_dir / name
+            if (not path.is_file() or path.stat().st_size != output["size"]
+                    or file_sha256(path) != output["sha256"]):
+                return False
+        return True
+
+    def record(self, date, time, extra_args, returncode, duration):
+        entry = {
+            "date": date,
+            "time": time,
+            "extra_args": extra_args,
+            "status": "completed" if returncode == 0 else "failed",
+            "exit_code": returncode,
+            "duration_s": round(duration, 1),
+            "finished": clock.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "outputs": {},
+        }
+        if returncode == 0:
+            entry["outputs"] = {
+                path.name: {"size": path.stat().st_size, "sha256": file_sha256(path)}
+                for path in date_outputs(self.output_dir, date, time)
+            }
+            if not entry["outputs"]:
+                print(f"  WARNING: {date} {time} completed but no output file matching "
+                      f"{output_pattern(date, time)} was found in {self.output_dir}; "
+                      "it is recorded as completed from its exit code only", flush=True)
+        with self.lock:
+            self.entries[self.key(date, time, extra_args)] = entry
+            # written to a temporary file first, so that it is never left half written
+            temporary = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+            temporary.write_text(json.dumps({"runs": self.entries}, indent=2) + "\n")
+            os.replace(temporary, self.path)
+
+
+# State of an --in-process worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(script):
+    # the directory of the script comes first, as when it is run directly, so
+    # that the modules next to it can be imported
+    sys.path.insert(0, str(Path(script).parent))
+    spec = importlib.util.spec_from_file_location(Path(script).stem, script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    _worker["module"] = module
+
+
+def _run_in_process(date, time, extra_args, log_file=None):
+    """Call the entry point of get_initial_conditions.py for one date.
+
+    Returns the exit code it would have had as a script. Exceptions are
+    printed and give an exit code of 1.
+    """
+    module = _worker["module"]
+    argv = sys.argv
+    sys.argv = [module.__file__] + date_args(date, time, extra_args)
+    with ExitStack() as stack:
+        if log_file is not None:
+            log = stack.enter_context(open(log_file, "w"))
+            stack.enter_context(redirect_stdout(log))
+            stack.enter_context(redirect_stderr(log))
+            print(f"# in-process: {ENTRY_POINT}({' '.join(sys.argv[1:])})", flush=True)
+        try:
+            getattr(module, ENTRY_POINT)()
+        except SystemExit as exit:
+            if exit.code is None or isinstance(exit.code, int):
+                return exit.code or 0
+            print(exit.code, file=sys.stderr)
+            return 1
+        except Exception:
+            traceback.print_exc()
+            return 1
+        finally:
+            sys.argv = argv
+            sys.stdout.flush()
+    return 0
+
+
+def clone_repo(dest, branch, url=WEATHERQUEST_REPO):
+    print(f"Cloning {url} (branch: {branch}) into {dest} ...")
     result = subprocess.run(
-        ["git", "clone", "--depth", "1", "--branch", branch, WEATHERQUEST_REPO, str(dest)],
+        ["git", "clone", "--depth", "1", "--branch", branch, url, str(dest)],
         check=False,
     )
     if result.returncode != 0:
@@ -97,6 +364,94 @@ def clone_repo(dest, branch):
     print("Clone complete.\n")
 
 
+def git(*args, git_dir=None):
+    """Run a git command, exiting with an error if it fails, and return its output."""
+    cmd = ["git"] + (["--git-dir", str(git_dir)] if git_dir else []) + list(args)
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, check=False)
+    if result.returncode != 0:
+        print(f"Error: {' '.join(cmd)} failed (exit code {result.returncode})", file=sys.stderr)
+        sys.exit(1)
+    return result.stdout.strip()
+
+
+def remote_head(url, branch):
+    """Commit of the branch on the remote, or None if it cannot be reached."""
+    try:
+        result = subprocess.run(
+            ["git", "ls-remote", url, f"refs/heads/{branch}"],
+            stdout=subprocess.PIPE, text=True, check=False, timeout=LS_REMOTE_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        return None
+    if result.returncode != 0 or not result.stdout.strip():
+        return None
+    return result.stdout.split()[0]
+
+
+def mirror_head(mirror, branch):
+    """Commit of the branch in the mirror, or None if it does not have it."""
+    result = subprocess.run(
+        ["git", "--git-dir", str(mirror), "rev-parse", "--verify", "-q", f"refs/heads/{branch}^{{commit}}"],
+        stdout=subprocess.PIPE, text=True, check=False,
+    )
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def worktree_head(worktree):
+    """Commit checked out in a worktree, or None if it is not a complete checkout."""
+    result = subprocess.run(
+        ["git", "-C", str(worktree), "rev-parse", "--verify", "-q", "HEAD"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=False,
+    )
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def cached_checkout(cache_dir, branch, url=WEATHERQUEST_REPO):
+    """Worktree of the head of branch, from the mirror of url in cache_dir.
+
+    The cache holds a bare mirror of the repo, mirror.git, and a worktree per
+    commit in worktrees/. It is only updated with an exclusive lock on
+    cache_dir/lock, so concurrent runs wait for each other and then share the
+    same worktree. The worktrees are never modified once created.
+    """
+    cache_dir = Path(cache_dir).expanduser().resolve()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    mirror = cache_dir / "mirror.git"
+    with open(cache_dir / "lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        remote = remote_head(url, branch)
+        if not mirror.exists():
+            if remote is None:
+                print(f"Error: {url} cannot be reached and there is no mirror in {cache_dir}",
+                      file=sys.stderr)
+                sys.exit(1)
+            print(f"Mirroring {url} into {mirror} ...")
+            git("clone", "--mirror", "--quiet", url, str(mirror))
+        elif remote is None:
+            print(f"{url} cannot be reached, using the mirror in {mirror}")
+        elif mirror_head(mirror, branch) != remote:
+            print(f"Fetching the new commits of {branch} into {mirror} ...")
+            git("fetch", "--prune", "--quiet", url, "+refs/heads/*:refs/heads/*",
+                "+refs/tags/*:refs/tags/*", git_dir=mirror)
+
+        commit = mirror_head(mirror, branch)
+        if commit is None:
+            print(f"Error: branch {branch} not found in {mirror}", file=sys.stderr)
+            sys.exit(1)
+
+        worktree = cache_dir / "worktrees" / commit
+        if worktree.exists() and worktree_head(worktree) != commit:
+            # left over by an interrupted run, and not a usable checkout
+            print(f"Removing the incomplete worktree {worktree}")
+            shutil.rmtree(worktree)
+        if not worktree.exists():
+            git("worktree", "prune", git_dir=mirror)
+            git("worktree", "add", "--detach", "--quiet", str(worktree), commit, git_dir=mirror)
+    print(f"Using {branch} at {commit[:12]} from {worktree}\n")
+    return worktree
+
+
 def main():
     args = parse_args()
 
@@ -117,17 +472,83 @@ def main():
         print(f"Processing {len(datetimes)} date(s): {', '.join(f'{d} {t}' for d, t in datetimes)}")
         print("-" * 60)
 
+        # the manifest lives with the outputs it describes
+        output_dir = output_dir_of(args.extra_args)
+        manifest_path = Path(args.manifest) if args.manifest else output_dir / MANIFEST_NAME
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        manifest = Manifest(manifest_path, output_dir)
+        pending = datetimes
+        if not args.force:
+            pending = [(date, time) for date, time in datetimes
+                       if not manifest.is_completed(date, time, args.extra_args)]
+            if len(pending) < len(datetimes):
+                print(f"Skipping {len(datetimes) - len(pending)} date(s) already completed "
+                      f"according to {manifest_path} (use --force to rerun them)")
+
+        if args.log_dir:
+            Path(args.log_dir).mkdir(parents=True, exist_ok=True)
+            print(f"Writing the output of each date to {args.log_dir}/")
+
+        workers = None
+        if args.in_process:
+            print(f"Calling {SCRIPT_REL_PATH}:{ENTRY_POINT}() in {args.jobs} worker process(es)")
+            workers = ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker,
+                                          initargs=(str(script),))
+
+        def run_one(date, time):
+            log_file = log_path(args.log_dir, date, time) if args.log_dir else None
+            start = clock.monotonic()
+            if workers is None:
+                returncode = run_date(script, date, time, args.extra_args, log_file)
+            else:
+                try:
+                    returncode = workers.submit(_run_in_process, date, time, args.extra_args,
+                                                log_file).result()
+                    reason = f"exit code {returncode}"
+                except Exception as error:
+                    # e.g. the module failed to import, or a worker died
+                    returncode, reason = 1, f"{type(error).__name__}: {error}"
+                if returncode != 0:
+                    # retry the date on its own, isolated from the shared state
+                    print(f"  {date} {time} failed in-process ({reason}), "
+                          "retrying in a subprocess", flush=True)
+                    returncode = run_date(script, date, time, args.extra_args, log_file,
+                                          append=True)
+            duration = clock.monotonic() - start
+            manifest.record(date, time, args.extra_args, returncode, duration)
+            return returncode, duration
+
         failed = []
-        for i, (date, time) in enumerate(datetimes, 1):
-            print(f"\n[{i}/{len(datetimes)}] Date: {date} {time}")
-            cmd = ["python", str(script), "--date", date, "--time", time] + args.extra_args
-            result = subprocess.run(cmd)
-            if result.returncode != 0:
-                print(
-                    f"  ERROR: get_initial_conditions.py failed for {date} {time} "
-                    f"(exit code {result.returncode})"
-                )
-                failed.append(f"{date} {time}")
+        if args.jobs == 1:
+            for i, (date, time) in enumerate(pending, 1):
+                print(f"\n[{i}/{len(pending)}] Date: {date} {time}")
+                returncode, _ = run_one(date, time)
+                if returncode != 0:
+                    print(
+                        f"  ERROR: get_initial_conditions.py failed for {date} {time} "
+                        f"(exit code {returncode})"
+                    )
+                    failed.append(f"{date} {time}")
+        else:
+            # the dates mostly wait on the CDS API and on disk, so threads
+            # running one subprocess each are enough
+            print(f"Running up to {args.jobs} dates at a time")
+            with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+                futures = {pool.submit(run_one, date, time): (date, time)
+                           for date, time in pending}
+                for done, future in enumerate(as_completed(futures), 1):
+                    date, time = futures[future]
+                    returncode, duration = future.result()
+                    status = "done" if returncode == 0 else f"FAILED (exit code {returncode})"
+                    print(f"[{done}/{len(pending)}] {date} {time}: {status} "
+                          f"in {duration:.0f} s, log: {log_path(args.log_dir, date, time)}",
+                          flush=True)
+            returncodes = {futures[future]: future.result()[0] for future in futures}
+            # failures are listed in the order of the dates, as with --jobs 1
+            failed = [f"{date} {time}" for date, time in pending
+                      if returncodes[(date, time)] != 0]
+        if workers is not None:
+            workers.shutdown()
 
         print("\n" + "=" * 60)
         if failed:
@@ -140,10 +561,12 @@ def main():
 
     if args.repo_dir:
         run_with_repo(args.repo_dir)
-    else:
+    elif args.no_cache:
         with tempfile.TemporaryDirectory(prefix="weatherquest_") as tmpdir:
-            clone_repo(tmpdir, args.branch)
+            clone_repo(tmpdir, args.branch, args.repo_url)
             run_with_repo(tmpdir)
+    else:
+        run_with_repo(cached_checkout(args.cache_dir, args.branch, args.repo_url))
 
 
 if __name__ == "__main__":